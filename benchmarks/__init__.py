@@ -21,32 +21,8 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
-# import numpy as np
-import os
+"""
+    Benchmarks for pydemx.
 
-# import yaml
-# try:
-# from yaml import CLoader as YamlLoader, CDumper as YamlDumper
-# except ImportError:
-# from yaml import YamlLoader, YamlDumper
-
-# def load(obj):
-# "Load yaml from object."
-# return yaml.load(obj, Loader=YamlLoader)
-
-# def write(file,  obj):
-# yaml.dump(obj, file, Dumper=YamlDumper)
-
-
-def readline(file):
-    """
-        Reads a line from file and strips line endings.
-
-        Returns None if EOF is reached.
-    """
-    line = file.readline()
-    if len(line) > 0:
-        # we still have something in the file (be it line endings)
-        return line.strip(os.linesep)
-    else:
-        return None
+    Run `python -m benchmarks --help` from the repository root for usage.
+"""
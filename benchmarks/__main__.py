@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2020 Oliver Breitwieser
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import sys
+import os.path as osp
+
+import docopt
+
+# make the benchmarks runnable from a source checkout
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+
+from . import bench_logging
+from . import bench_memory
+from . import bench_render
+from . import bench_startup
+from . import bench_threads
+from . import bench_tokenize
+from . import corpus
+from . import runner
+
+usage = """
+Benchmarks for pydemx (run as `python -m benchmarks`).
+
+Usage:
+    benchmarks run [options] [<corpus>...]
+    benchmarks compare <baseline.json> <current.json>
+    benchmarks generate [options] <folder> <corpus>...
+    benchmarks render [<num_lines> [<num_keys>]]
+    benchmarks startup [<budget_ms>]
+    benchmarks threads [<num_templates> [<num_threads>]]
+    benchmarks tokenize [<size_mb>]
+    benchmarks memory [<size_mb>]
+    benchmarks logging [<num_lines>]
+    benchmarks list
+
+Commands:
+    run         Time all phases for the given corpora (default: all).
+    compare     Show speedups of one result file over another.
+    generate    Only write the given corpora to <folder>.
+    render      Compare render plans with re.sub based rendering.
+    startup     Check the import time of pydemx against a budget.
+    threads     Render templates concurrently and check for interference.
+    tokenize    Compare tokenizing a large template with reading it.
+    memory      Check that streaming a large template bounds memory usage.
+    logging     Measure the cost of logging when parsing without verbose output.
+    list        List available corpora.
+
+Options:
+    -s --scale <factor>
+        Scale the size of all corpora. [default: 1.0]
+
+    -n --repeat <n>
+        Report the fastest of <n> runs. [default: 3]
+
+    -o --output <json>
+        Store the results in <json>.
+"""
+
+
+def main(argv=None):
+    args = docopt.docopt(usage, argv=argv)
+
+    if args["list"]:
+        for name in corpus.CORPORA:
+            print(name)
+
+    elif args["generate"]:
+        for name in args["<corpus>"]:
+            files = corpus.generate(
+                name, osp.join(args["<folder>"], name), scale=float(args["--scale"])
+            )
+            print("{}: {} files".format(name, len(files)))
+
+    elif args["run"]:
+        unknown = set(args["<corpus>"]) - set(corpus.CORPORA)
+        if unknown:
+            sys.exit("Unknown corpora: {}".format(", ".join(sorted(unknown))))
+        results = runner.run(
+            names=args["<corpus>"] or None,
+            scale=float(args["--scale"]),
+            repeat=int(args["--repeat"]),
+        )
+        if args["--output"] is not None:
+            runner.save(results, args["--output"])
+
+    elif args["compare"]:
+        runner.compare(
+            runner.load(args["<baseline.json>"]), runner.load(args["<current.json>"])
+        )
+
+    elif args["startup"]:
+        budget_ms = args["<budget_ms>"]
+        if budget_ms is None:
+            budget_ms = bench_startup.DEFAULT_BUDGET_MS
+        sys.exit(bench_startup.main(float(budget_ms)))
+
+    elif args["threads"]:
+        sys.exit(
+            bench_threads.main(
+                *map(
+                    int, filter(None, [args["<num_templates>"], args["<num_threads>"]])
+                )
+            )
+        )
+
+    elif args["tokenize"]:
+        bench_tokenize.main(*map(int, filter(None, [args["<size_mb>"]])))
+
+    elif args["memory"]:
+        sys.exit(bench_memory.main(*map(int, filter(None, [args["<size_mb>"]]))))
+
+    elif args["logging"]:
+        bench_logging.main(*map(int, filter(None, [args["<num_lines>"]])))
+
+    elif args["render"]:
+        bench_render.main(
+            *map(int, filter(None, [args["<num_lines>"], args["<num_keys>"]]))
+        )
+
+
+if __name__ == "__main__":
+    main()
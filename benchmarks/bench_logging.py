@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2020 Oliver Breitwieser
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+    Measure what logging costs when parsing a template without verbose
+    output: parsing with the default log level is compared with parsing while
+    logging is disabled altogether (and with writing a trace).
+
+    Usage: python benchmarks/bench_logging.py [num_lines]
+"""
+
+import logging
+import os.path as osp
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+
+from pydemx import logcfg
+from pydemx.logcfg import log
+
+from benchmarks.bench_render import make_template, parse
+
+
+def bench(text, repeat):
+    return min(timeit.repeat(lambda: parse(text), number=1, repeat=repeat))
+
+
+def main(num_lines=50000):
+    text = make_template(num_lines)
+
+    durations = {}
+    durations["default"] = bench(text, repeat=5)
+
+    logging.disable(logging.CRITICAL)
+    try:
+        durations["disabled"] = bench(text, repeat=5)
+    finally:
+        logging.disable(logging.NOTSET)
+
+    with tempfile.TemporaryDirectory() as folder:
+        trace = logcfg.start_trace(osp.join(folder, "trace.jsonl"))
+        try:
+            durations["trace"] = bench(text, repeat=1)
+        finally:
+            logcfg.stop_trace(trace)
+
+    print(
+        "Parsing {} lines (log level {}):".format(
+            num_lines, logging.getLevelName(log.getEffectiveLevel())
+        )
+    )
+    for name in ["disabled", "default", "trace"]:
+        print(
+            "  {:<9} {:8.3f} s  {:8.2f} us/line  {:+8.1f} %".format(
+                name,
+                durations[name],
+                durations[name] / num_lines * 1e6,
+                100 * (durations[name] / durations["disabled"] - 1),
+            )
+        )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2020 Oliver Breitwieser
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+    Render a large template once with its text streamed from the memory
+    mapped file and once read into memory; both outputs have to be identical
+    and the peak resident memory of streaming must not grow with the size of
+    the template.
+
+    Every render runs in a fresh process so that its peak resident memory
+    (which includes mapped pages of the file) can be measured on its own.
+
+    Usage: python benchmarks/bench_memory.py [size_mb]
+"""
+
+import copy
+import hashlib
+import os
+import os.path as osp
+import resource
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+
+from pydemx import config
+from pydemx.generator import Generator
+from pydemx.parser import Parser
+from pydemx.tokenizer import Buffer, Tokenizer
+
+# the template written by bench_tokenize has an empty text block between the
+# two blocks written every 1000 lines
+from benchmarks.bench_tokenize import write_template
+
+# allowed growth of the peak resident memory when streaming (independent of
+# the size of the template)
+BUDGET = 4 * Buffer.window_size
+
+
+def get_peak():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def render(filename, stream_threshold):
+    """
+        Render `filename` and print the digest of the output along with the
+        growth of the peak resident memory.
+    """
+    Tokenizer.stream_threshold = stream_threshold
+    cfg = copy.deepcopy(config.get_defaults())
+    cfg["filename"] = None
+
+    base = get_peak()
+    parser = Parser(cfg, Tokenizer.from_path(filename))
+    digest = hashlib.sha1()
+    for text in Generator(cfg, parser, key_value="bench").iter_text():
+        digest.update(text.encode("utf-8"))
+    print(digest.hexdigest(), get_peak() - base)
+
+
+def run(filename, stream_threshold):
+    output = subprocess.run(
+        [sys.executable, osp.abspath(__file__), "render"]
+        + [filename, str(stream_threshold)],
+        stdout=subprocess.PIPE,
+        check=True,
+        universal_newlines=True,
+    ).stdout.split()
+    return output[0], int(output[1])
+
+
+def main(size_mb=100):
+    with tempfile.TemporaryDirectory() as folder:
+        filename = osp.join(folder, "large.pydemx")
+        write_template(filename, size_mb * 1e6)
+        size = os.path.getsize(filename)
+
+        print("{:.1f} MB template:".format(size / 1e6))
+        results = {}
+        for name, stream_threshold in [("in memory", size + 1), ("streamed", 0)]:
+            digest, peak = results[name] = run(filename, stream_threshold)
+            print("  {:<10} {:8.1f} MB peak  {}".format(name, peak / 1e6, digest))
+
+    failed = False
+    if results["streamed"][0] != results["in memory"][0]:
+        print("Streamed output differs from the output rendered in memory!")
+        failed = True
+    if results["streamed"][1] > BUDGET:
+        print("Peak memory when streaming exceeds {:.1f} MB!".format(BUDGET / 1e6))
+        failed = True
+    return int(failed)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["render"]:
+        render(sys.argv[2], int(sys.argv[3]))
+    else:
+        sys.exit(main(*map(int, sys.argv[1:])))
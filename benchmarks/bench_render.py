@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2020 Oliver Breitwieser
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+    Compare rendering via precompiled render plans with the former approach
+    of running `re.sub` over every text block and replacement value.
+
+    Usage: python benchmarks/bench_render.py [num_lines] [num_keys]
+"""
+
+import copy
+import io
+import os
+import os.path as osp
+import sys
+import timeit
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+
+from pydemx import config
+from pydemx.generator import Generator
+from pydemx.parser import Parser
+from pydemx.tokenizer import Tokenizer
+
+
+class SubGenerator(Generator):
+    """
+        Renders the way pydemx did before render plans: `re.sub` over the
+        text with a callback resolving (and recursively substituting) each
+        replacement.
+    """
+
+    def set_key_value(self, key_value):
+        self.key_value = key_value
+        self.processing = set()
+        self.processed = {}
+
+    def get_replacement(self, match):
+        name = match.groupdict()["name"]
+
+        if name in self.processed:
+            return self.processed[name]
+        elif name in self.processing:
+            return ""
+
+        self.processing.add(name)
+        retval = self.processed[name] = self.process_text(
+            self.replacement_t(name)[self.key_value]
+        )
+        self.processing.remove(name)
+        return retval
+
+    def process_text(self, text):
+        return self.replacement_t.matcher.sub(self.get_replacement, str(text))
+
+    def iter_text(self):
+        for tb in self.text_blocks:
+            for text in tb.iter_text():
+                yield self.process_text(text)
+
+
+def make_template(num_lines, num_replacements=50, num_keys=10):
+    lines = ["#>>>", "#>>># "]
+    for r in range(num_replacements):
+        lines.append(
+            '# r = R("repl{0}", "default {0} {{{{nested{1}}}}}")'.format(r, r % 5)
+        )
+        for k in range(num_keys):
+            lines.append('# r["key{0}"] = "value {1} for key{0}"'.format(k, r))
+    for n in range(5):
+        lines.append('# R("nested{0}", "nested value {0}")["key0"] = "n{0}"'.format(n))
+    lines.append("#>>>")
+    for i in range(num_lines):
+        lines.append(
+            "line {0} with {{{{repl{1}}}}} and {{{{repl{2}:fallback}}}} and "
+            "some more text".format(i, i % num_replacements, (i * 7) % num_replacements)
+        )
+    return os.linesep.join(lines) + os.linesep
+
+
+def parse(text):
+    tokenizer = Tokenizer(io.StringIO(text))
+    cfg = copy.deepcopy(config.defaults)
+    return cfg, Parser(cfg, tokenizer)
+
+
+def bench(generator_t, cfg, parser, keys, repeat):
+    def run():
+        generator = generator_t(cfg, parser, key_value=keys[0])
+        for key in keys:
+            generator.set_key_value(key)
+            generator.render()
+
+    return min(timeit.repeat(run, number=1, repeat=repeat))
+
+
+def main(num_lines=20000, num_keys=10):
+    text = make_template(num_lines, num_keys=num_keys)
+    keys = ["key{}".format(k) for k in range(num_keys)]
+
+    cfg, parser = parse(text)
+    for key in keys:
+        assert (
+            Generator(cfg, parser, key_value=key).render()
+            == SubGenerator(cfg, parser, key_value=key).render()
+        )
+
+    print(
+        "{} lines ({:.1f} MB), rendered for {} keys:".format(
+            num_lines, len(text) / 1e6, num_keys
+        )
+    )
+    for name, generator_t in [("re.sub", SubGenerator), ("render plan", Generator)]:
+        duration = bench(generator_t, cfg, parser, keys, repeat=5)
+        print(
+            "  {:<12} {:8.3f} s  {:8.1f} MB/s".format(
+                name, duration, len(text) * num_keys / duration / 1e6
+            )
+        )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2020 Oliver Breitwieser
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+    Measure the import time of pydemx (via `python -X importtime`) and check
+    it against a budget.
+
+    Also reports the wall time of a minimal CLI invocation and fails if any
+    module that should only be imported on demand is imported eagerly.
+
+    Usage: python benchmarks/bench_startup.py [budget_ms]
+"""
+
+import os
+import os.path as osp
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = osp.dirname(osp.dirname(osp.abspath(__file__)))
+
+MODULE = "pydemx.main"
+
+# default budget for the cumulative import time of `MODULE`
+DEFAULT_BUDGET_MS = 60.0
+
+# modules that must not be imported when only importing `MODULE`
+LAZY_MODULES = [
+    "pkg_resources",
+    "importlib.resources",
+    "docopt",
+    "pprint",
+    "multiprocessing",
+    "ctypes",
+    "json",
+    "tracemalloc",
+    "sqlite3",
+]
+
+CLI_CODE = (
+    "import sys; from pydemx.main import main_loop; "
+    "sys.exit(main_loop(['pydemx', '--version']))"
+)
+
+
+def _run(args):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    return subprocess.run(
+        [sys.executable] + args,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+
+
+def measure_imports():
+    """
+        Return a dict mapping each imported module to its cumulative import
+        time (in microseconds).
+    """
+    result = _run(["-X", "importtime", "-c", "import " + MODULE])
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def measure_cli():
+    """
+        Return the wall time (in seconds) of a minimal CLI invocation.
+    """
+    start = time.perf_counter()
+    _run(["-c", CLI_CODE])
+    return time.perf_counter() - start
+
+
+def main(budget_ms=DEFAULT_BUDGET_MS, repeat=5):
+    """
+        Print the results and return 1 if the budget was exceeded or a module
+        in `LAZY_MODULES` was imported (0 otherwise).
+    """
+    # the first run populates the bytecode caches
+    measure_imports()
+
+    runs = [measure_imports() for _ in range(repeat)]
+    import_ms = [run[MODULE] / 1000 for run in runs]
+    cli_ms = [measure_cli() * 1000 for _ in range(repeat)]
+
+    print(
+        "import {}: {:.1f} ms (median {:.1f} ms, budget {:.1f} ms)".format(
+            MODULE, min(import_ms), statistics.median(import_ms), budget_ms
+        )
+    )
+    print(
+        "pydemx --version: {:.1f} ms (median {:.1f} ms)".format(
+            min(cli_ms), statistics.median(cli_ms)
+        )
+    )
+
+    print("slowest imports:")
+    slowest = sorted(runs[0].items(), key=lambda item: item[1], reverse=True)
+    for name, cumulative in slowest[:10]:
+        print("  {:>8.1f} ms  {}".format(cumulative / 1000, name))
+
+    exit_code = 0
+    eager = [name for name in LAZY_MODULES if name in runs[0]]
+    if eager:
+        print("imported eagerly: {}".format(", ".join(eager)))
+        exit_code = 1
+    if min(import_ms) > budget_ms:
+        print("import time exceeds budget")
+        exit_code = 1
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main(*map(float, sys.argv[1:2])))
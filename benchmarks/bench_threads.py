@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2020 Oliver Breitwieser
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+    Stress test for rendering templates concurrently within one process.
+
+    Many templates that use the same replacement names (with different values
+    and delimiters) are parsed and rendered from a thread pool; every result
+    has to match the result of rendering the same template on its own.
+
+    Parsing and rendering are timed separately, for the same templates
+    serially and from the thread pool.
+
+    Usage: python benchmarks/bench_threads.py [num_templates] [num_threads]
+"""
+
+import os
+import os.path as osp
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+
+from pydemx import Template
+
+# (prefix, suffix) used by the templates in turn, so that templates parsed
+# concurrently need different matchers
+DELIMITERS = [("{{", "}}"), ("<<", ">>"), ("@@", "@@")]
+
+NUM_KEYS = 4
+NUM_REPLACEMENTS = 20
+NUM_LINES = 200
+
+
+def make_template(index):
+    prefix, suffix = DELIMITERS[index % len(DELIMITERS)]
+    lines = [
+        "#>>>",
+        "#>>># ",
+        '# cfg["replacement_prefix"] = "{}"'.format(prefix),
+        '# cfg["replacement_suffix"] = "{}"'.format(suffix),
+        "#>>>",
+        "#>>>",
+    ]
+    for r in range(NUM_REPLACEMENTS):
+        lines.append(
+            '# r = R("repl{0}", "t{1} default {0} {2}repl{3}{4}")'.format(
+                r, index, prefix, (r + 1) % NUM_REPLACEMENTS if r % 4 else "x", suffix
+            )
+        )
+        for k in range(NUM_KEYS):
+            if (r + k + index) % 3 == 0:
+                lines.append('# r["key{0}"] = "t{1} key{0} {2}"'.format(k, index, r))
+    lines.append('# R("replx", "t{}")'.format(index))
+    lines.append("#>>>")
+    for i in range(NUM_LINES):
+        lines.append(
+            "line {} of t{}: {}repl{}{}".format(
+                i, index, prefix, i % NUM_REPLACEMENTS, suffix
+            )
+        )
+    return os.linesep.join(lines) + os.linesep
+
+
+def render_all(template):
+    return [template.render("key{}".format(k)) for k in range(NUM_KEYS)]
+
+
+def parse(texts, index):
+    return Template.from_string(texts[index], filename="t{}.pydemx".format(index))
+
+
+def print_timings(name, duration_parse, duration_render, renders):
+    print(
+        "  {:<8} parse {:8.3f} s  render {:8.3f} s  {:8.1f} renders/s".format(
+            name, duration_parse, duration_render, renders / duration_render
+        )
+    )
+
+
+def main(num_templates=200, num_threads=8):
+    texts = [make_template(i) for i in range(num_templates)]
+    renders = num_templates * NUM_KEYS
+    print(
+        "{} templates, {} keys each, {} threads:".format(
+            num_templates, NUM_KEYS, num_threads
+        )
+    )
+
+    # the same templates are parsed and rendered serially and from the thread
+    # pool, so the timings are comparable
+    start = time.perf_counter()
+    templates = [parse(texts, i) for i in range(num_templates)]
+    duration_parse = time.perf_counter() - start
+    start = time.perf_counter()
+    expected = [render_all(template) for template in templates]
+    print_timings("serial", duration_parse, time.perf_counter() - start, renders)
+
+    with ThreadPoolExecutor(num_threads) as pool:
+        start = time.perf_counter()
+        templates = list(pool.map(lambda i: parse(texts, i), range(num_templates)))
+        duration_parse = time.perf_counter() - start
+        start = time.perf_counter()
+        rendered = list(pool.map(render_all, templates))
+        print_timings("threads", duration_parse, time.perf_counter() - start, renders)
+
+        mismatches = [i for i in range(num_templates) if rendered[i] != expected[i]]
+
+        def parse_and_render(index):
+            template = parse(texts, index)
+            return template, render_all(template)
+
+        # not timed: switch threads as often as possible to provoke races
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+
+        results = list(pool.map(parse_and_render, range(num_templates)))
+
+        # render already parsed templates from several threads at once
+        templates = [template for template, _ in results]
+        shared = list(
+            pool.map(
+                lambda args: args[0].render("key{}".format(args[1])),
+                [(t, k) for k in range(NUM_KEYS) for t in templates for _ in range(2)],
+            )
+        )
+        sys.setswitchinterval(switch_interval)
+
+    for i, (_, rendered) in enumerate(results):
+        if rendered != expected[i] and i not in mismatches:
+            mismatches.append(i)
+    it_shared = iter(shared)
+    for k in range(NUM_KEYS):
+        for i in range(num_templates):
+            for _ in range(2):
+                if next(it_shared) != expected[i][k] and i not in mismatches:
+                    mismatches.append(i)
+
+    if mismatches:
+        print("Output differs for templates: {}".format(sorted(mismatches)))
+        return 1
+    print("All outputs match.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*map(int, sys.argv[1:])))
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2020 Oliver Breitwieser
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+    Compare the throughput of tokenizing a large template with reading the
+    file, along with the peak of memory allocated while tokenizing (memory
+    mapped files are not counted).
+
+    Usage: python benchmarks/bench_tokenize.py [size_mb]
+"""
+
+import os
+import os.path as osp
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, osp.dirname(osp.dirname(osp.abspath(__file__))))
+
+from pydemx.tokenizer import Tokenizer
+
+
+def write_template(filename, size):
+    """
+        Write a template of about `size` bytes with a replacement block and a
+        code block every 1000 lines.
+    """
+    header = "#>>>\n#>>># \n# cfg['filename'] = None\n#>>>\n"
+    line = "some text with a {{replacement}} and a {{default:value}} in it\n"
+    with open(filename, "w") as f:
+        f.write(header)
+        written = len(header)
+        block = 0
+        while written < size:
+            chunk = "".join([line] * 1000) + (
+                "#>>> block{0}\nvalue {0}\n#>>>\n"
+                "#>>>\n# R('replacement', 'default')\n#>>>\n".format(block)
+            )
+            f.write(chunk)
+            written += len(chunk)
+            block += 1
+
+
+def measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    duration = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, duration, peak
+
+
+def read(filename):
+    with open(filename, "rb") as f:
+        while f.read(1024 * 1024):
+            pass
+
+
+def tokenize(filename, stream_threshold):
+    Tokenizer.stream_threshold = stream_threshold
+    return Tokenizer.from_path(filename)
+
+
+def main(size_mb=100):
+    with tempfile.TemporaryDirectory() as folder:
+        filename = osp.join(folder, "large.pydemx")
+        write_template(filename, size_mb * 1e6)
+        size = os.path.getsize(filename)
+
+        print("{:.1f} MB template:".format(size / 1e6))
+        threshold = Tokenizer.stream_threshold
+        try:
+            for name, func in [
+                ("read", lambda: read(filename)),
+                ("in memory", lambda: tokenize(filename, size)),
+                ("mmap", lambda: tokenize(filename, 0)),
+            ]:
+                # the first run only brings the file into the page cache
+                func()
+                result, duration, peak = measure(func)
+                print(
+                    "  {:<10} {:8.3f} s  {:8.1f} MB/s  {:8.1f} MB peak".format(
+                        name, duration, size / duration / 1e6, peak / 1e6
+                    )
+                )
+                del result
+        finally:
+            Tokenizer.stream_threshold = threshold
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2020 Oliver Breitwieser
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+    Generators for synthetic `.pydemx` corpora.
+
+    Each corpus stresses one axis: many small files, a few huge files, many
+    replacements, deeply nested replacements, long lines, many replacement
+    blocks and many keys.
+"""
+
+import os
+import os.path as osp
+
+HEADER = ["#>>>", "#>>># "]
+
+
+def write_template(path, config_lines, text_lines):
+    """
+        Write a template consisting of a configuration block (without prefix)
+        followed by the given text lines.
+    """
+    lines = list(HEADER)
+    lines.extend("# " + line for line in config_lines)
+    lines.append("#>>>")
+    lines.extend(text_lines)
+    with open(path, "w") as f:
+        f.write(os.linesep.join(lines) + os.linesep)
+    return path
+
+
+def many_small_files(folder, scale=1.0):
+    files = []
+    for i in range(int(500 * scale)):
+        files.append(
+            write_template(
+                osp.join(folder, "small{}.pydemx".format(i)),
+                ['R("host", "localhost")["key1"] = "remote"'],
+                [
+                    "option{} = {{{{host}}}} {{{{port:{}}}}}".format(j, 8000 + j)
+                    for j in range(20)
+                ],
+            )
+        )
+    return files
+
+
+def huge_files(folder, scale=1.0):
+    files = []
+    for i in range(2):
+        files.append(
+            write_template(
+                osp.join(folder, "huge{}.pydemx".format(i)),
+                ['R("host", "localhost")["key1"] = "remote"'],
+                [
+                    "10.0.{}.{} host{}.{{{{host}}}} # {{{{comment:none}}}}".format(
+                        j // 256 % 256, j % 256, j
+                    )
+                    for j in range(int(200000 * scale))
+                ],
+            )
+        )
+    return files
+
+
+def many_replacements(folder, scale=1.0):
+    num = int(5000 * scale)
+    config_lines = [
+        'R("repl{0}", "default{0}")["key1"] = "value{0}"'.format(i) for i in range(num)
+    ]
+    text_lines = ["{{{{repl{}}}}} {{{{inline{}:x}}}}".format(i, i) for i in range(num)]
+    return [
+        write_template(
+            osp.join(folder, "many_replacements.pydemx"), config_lines, text_lines
+        )
+    ]
+
+
+def deep_nesting(folder, scale=1.0):
+    depth = int(200 * scale)
+    config_lines = [
+        'R("level{0}", "<{{{{level{1}}}}}>")'.format(i, i + 1) for i in range(depth)
+    ]
+    config_lines.append('R("level{}", "bottom")'.format(depth))
+    text_lines = [
+        "{{{{level{}}}}}".format(i % depth) for i in range(int(1000 * scale))
+    ]
+    return [
+        write_template(
+            osp.join(folder, "deep_nesting.pydemx"), config_lines, text_lines
+        )
+    ]
+
+
+def long_lines(folder, scale=1.0):
+    segment = "some text {{host}} more text {{port:80}} "
+    text_lines = [segment * int(2500 * scale) for _ in range(100)]
+    return [
+        write_template(
+            osp.join(folder, "long_lines.pydemx"),
+            ['R("host", "localhost")'],
+            text_lines,
+        )
+    ]
+
+
+def many_replacement_blocks(folder, scale=1.0):
+    lines = []
+    for i in range(int(2000 * scale)):
+        lines.append("#>>> block{}".format(i))
+        lines.append("default content of block {}".format(i))
+        lines.append("#>>> block{} @ key1,key2".format(i))
+        lines.append("specific content of block {} with {{{{host}}}}".format(i))
+        lines.append("#>>>")
+        lines.append("text between blocks {}".format(i))
+    return [
+        write_template(
+            osp.join(folder, "many_replacement_blocks.pydemx"),
+            ['R("host", "localhost")'],
+            lines,
+        )
+    ]
+
+
+def many_keys(folder, scale=1.0):
+    num_keys = int(2000 * scale)
+    config_lines = []
+    for r in range(20):
+        config_lines.append('r = R("repl{0}", "default{0}")'.format(r))
+        config_lines.append(
+            "r.update(('key{{}}'.format(k), 'value{0}_{{}}'.format(k)) "
+            "for k in range({1}))".format(r, num_keys)
+        )
+    text_lines = ["line {0}: {{{{repl{1}}}}}".format(i, i % 20) for i in range(200)]
+    return [
+        write_template(osp.join(folder, "many_keys.pydemx"), config_lines, text_lines)
+    ]
+
+
+# name -> (generator, keys to render for)
+CORPORA = {
+    "many_small_files": (many_small_files, None),
+    "huge_files": (huge_files, None),
+    "many_replacements": (many_replacements, None),
+    "deep_nesting": (deep_nesting, None),
+    "long_lines": (long_lines, None),
+    "many_replacement_blocks": (many_replacement_blocks, None),
+    "many_keys": (
+        many_keys,
+        lambda scale: ["key{}".format(k) for k in range(int(2000 * scale))],
+    ),
+}
+
+
+def generate(name, folder, scale=1.0):
+    """
+        Generate corpus `name` in `folder` and return the list of files.
+    """
+    if not osp.isdir(folder):
+        os.makedirs(folder)
+    return CORPORA[name][0](folder, scale=scale)
+
+
+def get_keys(name, scale=1.0):
+    """
+        Return the keys corpus `name` is rendered for (None for the key
+        returned by the key function).
+    """
+    keys = CORPORA[name][1]
+    return None if keys is None else keys(scale)
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2020 Oliver Breitwieser
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+    Times each phase of converting a corpus (tokenizing, reading the config,
+    parsing and writing) and stores the results as JSON.
+"""
+
+import json
+import os
+import os.path as osp
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from pydemx import config
+from pydemx import library
+from pydemx.config import Config
+from pydemx.generator import Generator
+from pydemx.parser import Parser
+from pydemx.tokenizer import Tokenizer
+from pydemx.version import __version__
+
+from . import corpus
+
+PHASES = ["tokenize", "config", "parse", "write"]
+
+# bump whenever the format of the results changes
+RESULTS_FORMAT = 1
+
+
+def convert(filename, output_folder, keys, timings):
+    """
+        Convert `filename` the same way `pydemx.main.parse_file` does, adding
+        the time spent in each phase to `timings`.
+    """
+    t_start = time.perf_counter()
+    tokenizer = Tokenizer.from_path(filename)
+    t_tokenized = time.perf_counter()
+
+    cfg = Config(filename, tokenizer.code_blocks[0])
+    cfg["folder"] = output_folder
+    cfg["filename"] = osp.splitext(osp.basename(filename))[0]
+    t_configured = time.perf_counter()
+
+    parser = Parser(
+        cfg,
+        tokenizer,
+        prelude=cfg.get_prelude(),
+        libraries=library.load_all(cfg.include_paths),
+    )
+    t_parsed = time.perf_counter()
+
+    generator = Generator(cfg, parser)
+    if keys is None:
+        generator.write()
+    else:
+        for key in keys:
+            generator.set_key_value(key)
+            generator.write(subfolder=key)
+    t_written = time.perf_counter()
+
+    timings["tokenize"] += t_tokenized - t_start
+    timings["config"] += t_configured - t_tokenized
+    timings["parse"] += t_parsed - t_configured
+    timings["write"] += t_written - t_parsed
+
+
+def get_size(path):
+    if osp.isfile(path):
+        return osp.getsize(path)
+    return sum(
+        osp.getsize(osp.join(folder, f))
+        for folder, _, files in os.walk(path)
+        for f in files
+    )
+
+
+def run_corpus(name, folder, scale=1.0, repeat=3):
+    """
+        Generate corpus `name` in `folder` and return the timings of the
+        fastest of `repeat` conversions.
+    """
+    files = corpus.generate(name, osp.join(folder, "input"), scale=scale)
+    keys = corpus.get_keys(name, scale=scale)
+    output_folder = osp.join(folder, "output")
+
+    best = None
+    for _ in range(repeat):
+        # every repetition starts from scratch
+        config.clear_cache()
+        shutil.rmtree(output_folder, ignore_errors=True)
+
+        timings = dict.fromkeys(PHASES, 0.0)
+        for filename in files:
+            convert(filename, output_folder, keys, timings)
+        if best is None or sum(timings.values()) < sum(best.values()):
+            best = timings
+
+    bytes_in = sum(get_size(f) for f in files)
+    bytes_out = get_size(output_folder)
+    total = sum(best.values())
+
+    return {
+        "files": len(files),
+        "keys": 1 if keys is None else len(keys),
+        "bytes_in": bytes_in,
+        "bytes_out": bytes_out,
+        "phases": best,
+        "total": total,
+        "mb_per_s": bytes_in / total / 1e6,
+        "files_per_s": len(files) / total,
+    }
+
+
+def run(names=None, scale=1.0, repeat=3):
+    """
+        Run the benchmark for all corpora in `names` (all if None).
+    """
+    if names is None:
+        names = list(corpus.CORPORA)
+
+    results = {
+        "format": RESULTS_FORMAT,
+        "pydemx": ".".join(map(str, __version__)),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "scale": scale,
+        "corpora": {},
+    }
+
+    for name in names:
+        folder = tempfile.mkdtemp(prefix="pydemx-bench-")
+        try:
+            results["corpora"][name] = run_corpus(
+                name, folder, scale=scale, repeat=repeat
+            )
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+        print_corpus(name, results["corpora"][name])
+
+    return results
+
+
+def print_corpus(name, result, file=sys.stdout):
+    phases = " ".join(
+        "{}={:.3f}s".format(phase, result["phases"][phase]) for phase in PHASES
+    )
+    file.write(
+        "{:<24} {:8.3f}s {:8.2f} MB/s {:10.1f} files/s  {}\n".format(
+            name, result["total"], result["mb_per_s"], result["files_per_s"], phases
+        )
+    )
+
+
+def save(results, filename):
+    with open(filename, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load(filename):
+    with open(filename, "r") as f:
+        return json.load(f)
+
+
+def compare(baseline, current, file=sys.stdout):
+    """
+        Print the speedup of `current` over `baseline` for each corpus and
+        phase (> 1 means faster).
+    """
+    file.write(
+        "{:<24} {:>8} ".format("corpus", "total")
+        + " ".join("{:>8}".format(phase) for phase in PHASES)
+        + "\n"
+    )
+
+    def ratio(before, after):
+        return "{:7.2f}x".format(before / after) if after > 0 else "      -"
+
+    for name, result in sorted(current["corpora"].items()):
+        if name not in baseline["corpora"]:
+            continue
+        before = baseline["corpora"][name]
+        file.write(
+            "{:<24} {} ".format(name, ratio(before["total"], result["total"]))
+            + " ".join(
+                ratio(before["phases"][phase], result["phases"][phase])
+                for phase in PHASES
+            )
+            + "\n"
+        )
@@ -23,5 +23,19 @@
 
 from .version import __version__
 
-from .logcfg import log
-from .parser import Parser
+# submodules are only imported once needed, so that e.g. the client (see
+# `pydemx.client`) starts quickly
+_lazy_attributes = {
+    "log": "logcfg",
+    "Parser": "parser",
+    "Template": "template",
+}
+
+
+def __getattr__(name):
+    if name in _lazy_attributes:
+        import importlib
+
+        module = importlib.import_module("." + _lazy_attributes[name], __name__)
+        return getattr(module, name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2020 Oliver Breitwieser
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+    Persistent cache for tokenized and parsed files.
+
+    Entries hold the block structure of a file (including the compiled code
+    blocks) and the replacements found while parsing it. They are keyed by a
+    hash over the contents of the file and of all cfg-files it depends on, so
+    stale entries are never used and simply age out of the cache.
+"""
+
+import collections
+import hashlib
+import importlib.util
+import marshal
+import os
+import os.path as osp
+import tempfile
+import threading
+
+from .logcfg import log
+from .version import __version__
+
+# bump whenever the format of the stored state changes
+CACHE_FORMAT = 2
+
+CACHE_ENV_FOLDER = "PYDEMX_CACHE_DIR"
+CACHE_ENV_MAX_SIZE = "PYDEMX_CACHE_SIZE"
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+ENTRY_SUFFIX = ".marshal"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def get_cache_folder():
+    """
+        Return the folder in which cache entries are stored.
+
+        Honors $PYDEMX_CACHE_DIR and $XDG_CACHE_HOME (in that order).
+    """
+    folder = os.environ.get(CACHE_ENV_FOLDER)
+    if folder:
+        return folder
+    base = os.environ.get("XDG_CACHE_HOME") or osp.join(
+        osp.expanduser("~"), ".cache"
+    )
+    return osp.join(base, "pydemx")
+
+
+def hash_files(paths, extra=()):
+    """
+        Return a hex digest over the contents of all `paths` and all strings
+        in `extra`.
+    """
+    digest = hashlib.sha1()
+    for item in extra:
+        digest.update(item.encode("utf-8"))
+        digest.update(b"\0")
+    for path in paths:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class TemplateCache(object):
+    """
+        On-disk cache of marshalled file states with size-bounded (least
+        recently used) eviction.
+
+        The folder is only scanned on the first store and whenever the size of
+        the entries (kept track of while storing) exceeds the maximum size.
+        Eviction then removes entries until the cache is below `evict_ratio`
+        of its maximum size, so that it does not have to be scanned again for
+        every following store.
+    """
+
+    evict_ratio = 0.9
+
+    def __init__(self, folder=None, max_size=None):
+        if folder is None:
+            folder = get_cache_folder()
+        if max_size is None:
+            max_size = int(os.environ.get(CACHE_ENV_MAX_SIZE, DEFAULT_MAX_SIZE))
+        self.folder = folder
+        self.max_size = max_size
+        # total size of all entries (None until the folder was scanned)
+        self.size = None
+
+    def make_key(self, filename, cfg_paths):
+        """
+            Compute the key for `filename` which depends on the config files in
+            `cfg_paths`.
+        """
+        extra = (
+            str(CACHE_FORMAT),
+            ".".join(map(str, __version__)),
+            importlib.util.MAGIC_NUMBER.hex(),
+        )
+        # the paths of the cfg files are part of the key since they decide the
+        # order in which the cfg files are applied
+        extra += tuple(cfg_paths)
+        return hash_files([filename] + list(cfg_paths), extra=extra)
+
+    def _entry_path(self, key):
+        return osp.join(self.folder, key + ENTRY_SUFFIX)
+
+    def load(self, key):
+        """
+            Return the stored state for `key` or None if there is none.
+        """
+        path = self._entry_path(key)
+        try:
+            with open(path, "rb") as f:
+                state = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+
+        # mark entry as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        log.debug("Cache hit: %s", key)
+        return state
+
+    def store(self, key, state):
+        """
+            Store `state` under `key` and evict old entries if the cache grew
+            too large.
+        """
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        except OSError as e:
+            log.warn("Could not create cache entry: {}".format(e))
+            return
+        path = self._entry_path(key)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                marshal.dump(state, f)
+                size = f.tell()
+            try:
+                # an existing entry is replaced
+                size -= os.stat(path).st_size
+            except OSError:
+                pass
+            os.replace(tmp_path, path)
+        except (OSError, ValueError) as e:
+            log.warn("Could not write cache entry: {}".format(e))
+            os.remove(tmp_path)
+            return
+        log.debug("Cache store: %s", key)
+
+        if self.size is not None:
+            self.size += size
+        if self.size is None or self.size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """
+            Remove least recently used entries if the cache is larger than its
+            maximum size, until it is smaller than `evict_ratio` of it.
+        """
+        entries = []
+        total_size = 0
+        try:
+            with os.scandir(self.folder) as it:
+                for entry in it:
+                    if not entry.name.endswith(ENTRY_SUFFIX):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total_size += stat.st_size
+        except OSError:
+            return
+
+        self.size = total_size
+        if total_size <= self.max_size:
+            return
+
+        target_size = self.max_size * self.evict_ratio
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= target_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            log.debug("Cache evicted: %s", path)
+            total_size -= size
+        self.size = total_size
+
+
+class MemoryTemplateCache(object):
+    """
+        In-memory alternative to `TemplateCache` for long running processes,
+        keeping at most `max_entries` states (least recently used ones are
+        evicted).
+
+        Entries are keyed by the modification times and sizes of the file and
+        its cfg files instead of their contents.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def make_key(self, filename, cfg_paths):
+        key = []
+        for path in [filename] + list(cfg_paths):
+            stat = os.stat(path)
+            key.append((osp.abspath(path), stat.st_mtime_ns, stat.st_size))
+        return tuple(key)
+
+    def load(self, key):
+        with self.lock:
+            state = self.entries.get(key)
+            if state is not None:
+                self.entries.move_to_end(key)
+        if state is not None:
+            log.debug("Cache hit: %s", key[0][0])
+        return state
+
+    def store(self, key, state):
+        with self.lock:
+            self.entries[key] = state
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2020 Oliver Breitwieser
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+    Thin client forwarding command lines to a running pydemx daemon (see
+    `pydemx.daemon`).
+
+    Only modules that are needed anyway are imported here, so that the client
+    starts quickly. If no daemon is running, the command line is run in the
+    client process instead.
+"""
+
+import json
+import os
+import os.path as osp
+import socket
+import struct
+import sys
+
+SOCKET_ENV = "PYDEMX_SOCKET"
+
+RECV_SIZE = 64 * 1024
+
+
+def get_socket_path():
+    """
+        Return the path of the socket the daemon listens on.
+
+        Honors $PYDEMX_SOCKET and $XDG_RUNTIME_DIR (in that order).
+    """
+    path = os.environ.get(SOCKET_ENV)
+    if path:
+        return path
+    folder = os.environ.get("XDG_RUNTIME_DIR")
+    if folder:
+        return osp.join(folder, "pydemx.sock")
+    return osp.join(
+        os.environ.get("TMPDIR", "/tmp"), "pydemx-{}.sock".format(os.getuid())
+    )
+
+
+def recv_all(sock):
+    chunks = []
+    while True:
+        chunk = sock.recv(RECV_SIZE)
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+
+def get_peer_uid(sock, socket_path):
+    """
+        Return the id of the user running the process at the other end of the
+        connected `sock` (or owning the socket file if the platform does not
+        report it).
+    """
+    if hasattr(socket, "SO_PEERCRED"):
+        # struct ucred: pid, uid, gid
+        creds = sock.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+        )
+        return struct.unpack("3i", creds)[1]
+    return os.stat(socket_path).st_uid
+
+
+def send_request(request, socket_path=None):
+    """
+        Send `request` to the daemon and return its response.
+
+        Raises OSError if no daemon is listening and PermissionError if the
+        daemon is run by another user (the request contains the environment
+        of the client).
+    """
+    if socket_path is None:
+        socket_path = get_socket_path()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        if get_peer_uid(sock, socket_path) != os.getuid():
+            raise PermissionError(
+                "{} is not served by the current user".format(socket_path)
+            )
+        sock.sendall(json.dumps(request).encode("utf-8"))
+        sock.shutdown(socket.SHUT_WR)
+        return json.loads(recv_all(sock).decode("utf-8"))
+
+
+def make_request(argv):
+    """
+        Describe running pydemx with the command line arguments `argv` in the
+        current environment.
+    """
+    umask = os.umask(0)
+    os.umask(umask)
+    return {
+        "argv": list(argv),
+        "cwd": os.getcwd(),
+        "env": dict(os.environ),
+        "umask": umask,
+    }
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv
+
+    try:
+        response = send_request(make_request(argv[1:]))
+    except PermissionError as e:
+        sys.stderr.write("Not using daemon: {}\n".format(e))
+        response = None
+    except OSError:
+        # no daemon running
+        response = None
+
+    if response is None:
+        from .main import main_loop
+
+        return main_loop(argv)
+
+    sys.stdout.write(response["stdout"])
+    sys.stdout.flush()
+    sys.stderr.write(response["stderr"])
+    return response["exit_code"]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -24,11 +24,13 @@
 import os.path as osp
 import os
 import copy
-
-from pkg_resources import resource_string
+import threading
 
 from . import misc as m
+from . import prelude
+from .keys import Groups
 from .logcfg import log
+from .prelude import PRELUDE_FILENAME
 
 CONFIG_FILENAME = "cfg.pydemx"
 DEFAULT_SUFFIX = ".default"
@@ -52,19 +54,211 @@ def load_config(text):
         return {}
 
 
+# folder -> paths of all cfgs in and above it
+_cfg_paths_cache = {}
+# folder -> defaults updated with all cfgs in and above it
+_folder_cfg_cache = {}
+# folder -> path of the nearest prelude in or above it (or None)
+_prelude_path_cache = {}
+# path -> modification time of all folders searched for cfgs and all cfgs
+# loaded (see `validate_cache`)
+_cache_mtimes = {}
+# guards all of the above (reentrant since lookups recurse to parent folders)
+_cache_lock = threading.RLock()
+
+
+def clear_cache():
+    """
+        Forget all cfgs found/loaded so far (needed if cfgs might have changed).
+    """
+    with _cache_lock:
+        _cfg_paths_cache.clear()
+        _folder_cfg_cache.clear()
+        _prelude_path_cache.clear()
+        _cache_mtimes.clear()
+
+
+def _get_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def validate_cache():
+    """
+        Clear the cache if any cfg was created, modified or removed since it
+        was loaded (for long running processes). Returns False if the cache
+        was cleared.
+    """
+    with _cache_lock:
+        for path, mtime in _cache_mtimes.items():
+            if _get_mtime(path) != mtime:
+                log.debug("%s changed, reloading cfgs.", path)
+                clear_cache()
+                return False
+    return True
+
+
+def _get_folder_cfg_paths(folder):
+    paths = _cfg_paths_cache.get(folder)
+    if paths is not None:
+        return paths
+
+    with _cache_lock:
+        paths = _cfg_paths_cache.get(folder)
+        if paths is None:
+            if not osp.basename(folder):
+                paths = ()
+            else:
+                paths = _get_folder_cfg_paths(osp.dirname(folder))
+                log.debug("Checking %s", folder)
+                # creating or removing a cfg changes the folder
+                _cache_mtimes[folder] = _get_mtime(folder)
+                path_cfg = osp.join(folder, CONFIG_FILENAME)
+                if osp.isfile(path_cfg):
+                    paths = paths + (path_cfg,)
+            _cfg_paths_cache[folder] = paths
+    return paths
+
+
+def find_cfg_paths(path):
+    """
+        Return the paths of all cfgs that are above the current path (the
+        higher they are in the filesystem, the earlier they are returned).
+
+        Results are cached per folder for the rest of the run (see
+        `clear_cache`).
+    """
+    path = osp.abspath(path)
+    if not osp.basename(path):
+        return []
+    paths = list(_get_folder_cfg_paths(osp.dirname(path)))
+
+    # `path` itself might be a folder
+    path_cfg = osp.join(path, CONFIG_FILENAME)
+    if osp.isfile(path_cfg):
+        paths.append(path_cfg)
+    return paths
+
+
+def _get_folder_prelude_path(folder):
+    if folder in _prelude_path_cache:
+        return _prelude_path_cache[folder]
+
+    with _cache_lock:
+        if folder not in _prelude_path_cache:
+            path = osp.join(folder, PRELUDE_FILENAME)
+            if osp.isfile(path):
+                _cache_mtimes[folder] = _get_mtime(folder)
+            elif osp.basename(folder):
+                path = _get_folder_prelude_path(osp.dirname(folder))
+            else:
+                path = None
+            _prelude_path_cache[folder] = path
+    return _prelude_path_cache[folder]
+
+
+def find_prelude_path(path):
+    """
+        Return the path of the prelude nearest to `path` (in its folder or
+        above), None if there is none.
+    """
+    return _get_folder_prelude_path(osp.dirname(osp.abspath(path)))
+
+
+def get_prelude_path(path):
+    """
+        Return the path of the prelude used for the file at `path`: the one set
+        by the external configs (`cfg["prelude"]`, False to use none) or the
+        nearest one.
+    """
+    prelude_path = get_folder_cfg(osp.dirname(osp.abspath(path))).get("prelude")
+    if prelude_path is None:
+        return find_prelude_path(path)
+    return prelude_path or None
+
+
+def resolve_includes(folder, include):
+    """
+        Return the paths of the libraries in `include` (a path or a list of
+        paths, relative to `folder`).
+    """
+    if not include:
+        return []
+    if isinstance(include, str):
+        include = [include]
+    return [osp.normpath(osp.join(folder, osp.expanduser(path))) for path in include]
+
+
+def get_folder_cfg(folder):
+    """
+        Return the defaults updated with all cfgs in and above `folder`.
+
+        Each cfg file is only loaded once per run and the merged config of a
+        folder is shared by all files within it (see `clear_cache`), so the
+        result must not be modified.
+    """
+    folder = osp.abspath(folder)
+    cfg = _folder_cfg_cache.get(folder)
+    if cfg is not None:
+        return cfg
+
+    with _cache_lock:
+        cfg = _folder_cfg_cache.get(folder)
+        if cfg is None:
+            if not osp.basename(folder):
+                cfg = get_defaults()
+            else:
+                cfg = get_folder_cfg(osp.dirname(folder))
+                paths = _get_folder_cfg_paths(folder)
+                if paths and osp.dirname(paths[-1]) == folder:
+                    _cache_mtimes[paths[-1]] = _get_mtime(paths[-1])
+                    folder_cfg = load_config_from_path(paths[-1])
+                    included = cfg["include"]
+                    cfg = dict(cfg)
+                    cfg.update(folder_cfg)
+                    # libraries are given relative to the cfg including them
+                    # (in addition to those included above)
+                    if "include" in folder_cfg:
+                        cfg["include"] = included + resolve_includes(
+                            folder, folder_cfg["include"]
+                        )
+                    # preludes are given relative to the cfg setting them
+                    if cfg.get("prelude"):
+                        cfg["prelude"] = osp.join(
+                            folder, osp.expanduser(cfg["prelude"])
+                        )
+                    # group memberships are computed once per cfg
+                    cfg["groups"] = Groups.from_cfg(cfg.get("groups"))
+            _folder_cfg_cache[folder] = cfg
+    return cfg
+
+
 class Config(object):
     """
         Loads the default config and updates it with external config (if found)
         and the cfg section of the file in question.
+
+        If `path` is None, no external configs are searched for (and no
+        prelude is used).
+
+        The prelude is set by the external configs (`cfg["prelude"]`, False to
+        use none), otherwise the nearest `prelude.pydemx.py` is used.
+
+        The libraries included by the external configs and the cfg section
+        (`cfg["include"]`) are collected in `include_paths`.
     """
 
     def __init__(self, path, cfg_code_block):
         log.debug("Reading config.")
-        cfg = copy.deepcopy(defaults)
-
-        # update from external config
-        for ext_cfg in self.find_cfgs(path):
-            cfg.update(ext_cfg)
+        if path is None:
+            cfg = copy.deepcopy(get_defaults())
+            self.prelude_path = None
+        else:
+            # defaults updated from external configs
+            cfg = copy.deepcopy(get_folder_cfg(osp.dirname(osp.abspath(path))))
+            self.prelude_path = get_prelude_path(path)
 
         # update from the provided config block
         # just mock an R object here because that information will be extracted
@@ -72,29 +266,36 @@ class Config(object):
         def mock_R(*args):
             return {}
 
-        local_context = {"cfg": {}, "R": mock_R}
-        m.execute_code(cfg_code_block.lines, local_context=local_context)
-        cfg.update(local_context["cfg"])
+        local_context = prelude.make_context(self.get_prelude(), cfg={}, R=mock_R)
+        m.execute_code(cfg_code_block.compile(), local_context=local_context)
+        file_cfg = local_context["cfg"]
+        included = cfg["include"]
+        cfg.update(file_cfg)
+        cfg["groups"] = Groups.from_cfg(cfg.get("groups"))
+
+        # libraries included by the file itself are relative to it
+        if "include" in file_cfg:
+            folder = "." if path is None else osp.dirname(osp.abspath(path))
+            cfg["include"] = included + resolve_includes(folder, file_cfg["include"])
+        # each library is only included once
+        self.include_paths = list(dict.fromkeys(cfg["include"]))
 
         self._cfg = cfg
 
+    def get_prelude(self):
+        """
+            Return the read-only namespace of the prelude (empty if there is
+            none).
+        """
+        return prelude.load(self.prelude_path)
+
     def find_cfgs(self, path):
         """
             Find all cfgs that are above the current path and return them in
             reverse order (the higher they are in the filesystem, the earlier
             they are returned).
         """
-        path = osp.abspath(path)
-        found_paths = []
-        while osp.basename(path):
-            log.debug("Checking {}".format(path))
-            path_cfg = osp.join(path, CONFIG_FILENAME)
-
-            if osp.isfile(path_cfg):
-                found_paths.append(path_cfg)
-            path = osp.dirname(path)
-
-        for path_cfg in reversed(found_paths):
+        for path_cfg in find_cfg_paths(path):
             yield load_config_from_path(path_cfg)
 
     def __getitem__(self, key):
@@ -104,4 +305,35 @@ class Config(object):
         self._cfg[key] = value
 
 
-defaults = load_config(resource_string(__name__, CONFIG_FILENAME + DEFAULT_SUFFIX))
+_defaults = None
+
+
+def get_defaults():
+    """
+        Return the default config (shipped as `cfg.pydemx.default`).
+
+        It is only loaded once it is needed so that importing pydemx stays
+        cheap.
+    """
+    global _defaults
+    if _defaults is not None:
+        return _defaults
+
+    with _cache_lock:
+        if _defaults is None:
+            import importlib.resources
+
+            text = (
+                importlib.resources.files(__package__)
+                .joinpath(CONFIG_FILENAME + DEFAULT_SUFFIX)
+                .read_text()
+            )
+            _defaults = load_config(text)
+    return _defaults
+
+
+def __getattr__(name):
+    # keep `config.defaults` working without loading it on import
+    if name == "defaults":
+        return get_defaults()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
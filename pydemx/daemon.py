@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2020 Oliver Breitwieser
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+    Daemon keeping tokenized and parsed files as well as cfgs in memory and
+    running command lines sent by clients (see `pydemx.client`).
+
+    Requests are handled one after another, each in the working directory,
+    environment and umask of the client, so that the results are the same as
+    when running pydemx directly.
+"""
+
+import json
+import os
+import signal
+import socket
+import sys
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+from io import StringIO
+
+from . import config
+from . import keys
+from . import logcfg
+from .cache import MemoryTemplateCache
+from .client import get_peer_uid, get_socket_path, recv_all
+from .logcfg import log
+
+
+class Daemon(object):
+    """
+        Serves requests on the Unix socket at `socket_path`.
+    """
+
+    def __init__(self, socket_path=None, cache_size=256):
+        if socket_path is None:
+            socket_path = get_socket_path()
+        self.socket_path = socket_path
+        self.cache = MemoryTemplateCache(cache_size)
+        # set while a request is handled (see `_terminate`)
+        self.busy = False
+        self.terminated = False
+
+    def _bind(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        if os.path.exists(self.socket_path):
+            try:
+                sock.connect(self.socket_path)
+            except OSError:
+                # left over from a daemon that did not shut down cleanly
+                os.remove(self.socket_path)
+            else:
+                sock.close()
+                raise RuntimeError(
+                    "A daemon is already listening on {}".format(self.socket_path)
+                )
+            sock.close()
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        # only the current user may connect
+        umask = os.umask(0o177)
+        try:
+            sock.bind(self.socket_path)
+        finally:
+            os.umask(umask)
+        sock.listen(16)
+        return sock
+
+    def serve(self):
+        """
+            Handle requests until interrupted (or terminated).
+        """
+        sock = self._bind()
+        signal.signal(signal.SIGTERM, self._terminate)
+        log.info("Listening on {}".format(self.socket_path))
+        try:
+            while not self.terminated:
+                conn, _ = sock.accept()
+                with conn:
+                    self.busy = True
+                    try:
+                        self.handle(conn)
+                    finally:
+                        self.busy = False
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sock.close()
+            os.remove(self.socket_path)
+        return 0
+
+    def _terminate(self, signum, frame):
+        """
+            Stop serving, after the current request if one is handled (so that
+            exiting cannot be mistaken for the exit of its command line).
+        """
+        self.terminated = True
+        if not self.busy:
+            sys.exit(0)
+
+    def handle(self, conn):
+        # requests are run with the permissions of the daemon
+        if get_peer_uid(conn, self.socket_path) != os.getuid():
+            log.warn("Ignoring request of another user.")
+            return
+
+        try:
+            request = json.loads(recv_all(conn).decode("utf-8"))
+        except (OSError, ValueError) as e:
+            log.warn("Could not read request: {}".format(e))
+            return
+
+        try:
+            response = self.run(request)
+        except Exception:
+            response = {"exit_code": 1, "stdout": "", "stderr": traceback.format_exc()}
+
+        try:
+            conn.sendall(json.dumps(response).encode("utf-8"))
+        except OSError as e:
+            log.warn("Could not send response: {}".format(e))
+
+    def run(self, request):
+        """
+            Run the command line of `request` and return the exit code along
+            with everything written to stdout and stderr.
+        """
+        # imported here since it imports this module
+        from .main import main_loop
+
+        stdout = StringIO()
+        stderr = StringIO()
+
+        cwd = os.getcwd()
+        environ = dict(os.environ)
+        umask = os.umask(request["umask"])
+        try:
+            os.environ.clear()
+            os.environ.update(request["env"])
+            os.chdir(request["cwd"])
+            config.validate_cache()
+            # key functions might return something else for each request
+            keys.clear_cache()
+
+            with redirect_stdout(stdout), redirect_stderr(stderr):
+                with logcfg.redirect_output(stderr):
+                    try:
+                        exit_code = main_loop(["pydemx"] + request["argv"], daemon=self)
+                    except SystemExit as e:
+                        # raised by docopt for --help, --version and usage errors
+                        if e.code is None or isinstance(e.code, int):
+                            exit_code = e.code or 0
+                        else:
+                            stderr.write(str(e.code) + os.linesep)
+                            exit_code = 1
+                    except Exception:
+                        traceback.print_exc(file=stderr)
+                        exit_code = 1
+        finally:
+            os.chdir(cwd)
+            os.environ.clear()
+            os.environ.update(environ)
+            os.umask(umask)
+
+        return {
+            "exit_code": exit_code,
+            "stdout": stdout.getvalue(),
+            "stderr": stderr.getvalue(),
+        }
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2020 Oliver Breitwieser
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import hashlib
+import marshal
+import os
+import os.path as osp
+
+from .cache import get_cache_folder, hash_files
+from .config import find_cfg_paths, find_prelude_path, get_prelude_path
+from .logcfg import log
+from . import misc as m
+
+# bump whenever the format of the stored records changes
+DEPS_FORMAT = 3
+
+
+def hash_file(path):
+    return hash_files([path])
+
+
+def describe_input(path):
+    """
+        Return the description of an input file as stored in a record.
+    """
+    st = os.stat(path)
+    return (path, st.st_mtime_ns, st.st_size, hash_file(path))
+
+
+def describe_output(path):
+    """
+        Return the description of an output file as stored in a record.
+    """
+    st = os.stat(path)
+    return (path, st.st_mtime_ns, st.st_size)
+
+
+class DependencyStore(object):
+    """
+        Records which inputs (the file itself, its cfg files and included
+        files) and which key produced the outputs of a file, so that files
+        whose inputs did not change since the last conversion can be skipped
+        without reading them.
+
+        Inputs are compared by modification time and size first and only
+        hashed if those differ.
+    """
+
+    def __init__(self, folder=None):
+        if folder is None:
+            folder = osp.join(get_cache_folder(), "deps")
+        self.folder = folder
+        # read once instead of for every record (see `misc.get_umask`)
+        self.umask = m.get_umask()
+
+    def _record_path(self, filename):
+        name = hashlib.sha1(
+            osp.abspath(filename).encode("utf-8", "surrogateescape")
+        ).hexdigest()
+        return osp.join(self.folder, name + ".marshal")
+
+    def load(self, filename):
+        try:
+            with open(self._record_path(filename), "rb") as f:
+                record = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        if record.get("format") != DEPS_FORMAT:
+            return None
+        return record
+
+    def is_up_to_date(self, filename, signature):
+        """
+            Check if `filename` was converted with the same `signature` (which
+            describes the key(s) and options used) and neither the inputs nor
+            the outputs changed since.
+        """
+        if signature is None:
+            return False
+
+        record = self.load(filename)
+        if record is None or record["signature"] != signature:
+            return False
+
+        # a cfg file or prelude might have been added or removed
+        if record["cfg_paths"] != find_cfg_paths(filename):
+            return False
+        if record["prelude_path"] != find_prelude_path(filename):
+            return False
+
+        for path, mtime_ns, size, digest in record["inputs"]:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return False
+            if st.st_mtime_ns == mtime_ns and st.st_size == size:
+                continue
+            if st.st_size != size or hash_file(path) != digest:
+                log.debug("Input %s changed.", path)
+                return False
+
+        for path, mtime_ns, size in record["outputs"]:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return False
+            if st.st_mtime_ns != mtime_ns or st.st_size != size:
+                log.debug("Output %s changed.", path)
+                return False
+
+        return True
+
+    def snapshot(self, filename):
+        """
+            Describe the current state of the inputs of `filename` (the file
+            itself, its cfg files and its prelude) to be passed to `record`
+            once it was converted (libraries are added via `add_included`).
+
+            Has to be taken before any of the inputs is read so that changes
+            made while converting are detected on the next run.
+        """
+        filename = osp.abspath(filename)
+        cfg_paths = find_cfg_paths(filename)
+        snapshot = {
+            "cfg_paths": cfg_paths,
+            "prelude_path": find_prelude_path(filename),
+            "included": [],
+            "inputs": [describe_input(path) for path in [filename] + cfg_paths],
+        }
+        # the prelude might be set by the cfg files (described above)
+        self.add_included(snapshot, filter(None, [get_prelude_path(filename)]))
+        return snapshot
+
+    def add_included(self, snapshot, included):
+        """
+            Add the `included` files (i.e. libraries) to `snapshot` before
+            they are read.
+        """
+        for path in included:
+            path = osp.abspath(path)
+            if path not in snapshot["included"]:
+                snapshot["included"].append(path)
+                snapshot["inputs"].append(describe_input(path))
+
+    def record(self, filename, signature, snapshot, outputs=()):
+        """
+            Record that `filename` was converted with `signature` from the
+            inputs described by `snapshot` (see `snapshot`), producing
+            `outputs`.
+
+            Nothing is recorded if `signature` is None (i.e. the output cannot
+            be predicted from the inputs alone).
+        """
+        if signature is None:
+            self.forget(filename)
+            return
+
+        record = dict(snapshot)
+        record.update(
+            {
+                "format": DEPS_FORMAT,
+                "signature": signature,
+                "outputs": [describe_output(path) for path in outputs],
+            }
+        )
+        try:
+            m.replace_file(
+                self._record_path(filename), marshal.dumps(record), umask=self.umask
+            )
+        except OSError as e:
+            log.warn("Could not record dependencies: {}".format(e))
+
+    def get_included(self, filename):
+        """
+            Return the files (preludes and libraries) included by `filename`
+            when it was last converted.
+        """
+        record = self.load(filename)
+        if record is None:
+            return []
+        return record["included"]
+
+    def forget(self, filename):
+        try:
+            os.remove(self._record_path(filename))
+        except OSError:
+            pass
@@ -21,11 +21,17 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+import hashlib
 import os
 import os.path as osp
 import sys
 
 from .logcfg import log
+from . import misc as m
+from .keys import Groups, get_key_value
+from .output import OutputWriter
+from .plan import RenderPlan
+from .profiling import NO_PROFILE
 
 
 class Generator(object):
@@ -35,76 +41,239 @@ class Generator(object):
         "folder",
         "permissions",
         "key_func",
+        "groups",
     ]
 
-    def __init__(self, cfg, parser):
+    def __init__(
+        self,
+        cfg,
+        parser,
+        key_value=None,
+        profile=NO_PROFILE,
+        block_plans=None,
+        output=None,
+    ):
+        """
+            `block_plans` can be a dictionary in which render plans for the
+            text blocks of `parser` are kept (to share them between
+            generators, possibly in different threads).
+
+            Output files are written via `output` (an `output.OutputWriter`
+            shared by all files of a run).
+        """
         log.debug("Generating.")
+        self.profile = profile
+        if output is None:
+            output = OutputWriter()
+        self.output = output
         self.cfg = {k: cfg[k] for k in self.config_keys}
         self.replacement_t = parser.replacement_t
         self.text_blocks = parser.text_blocks
+        self.graph = parser.graph
+        self.groups = Groups.from_cfg(self.cfg["groups"])
 
-        self.key_value = self.cfg["key_func"]()
+        # render plans for text blocks (by index), they do not depend on the
+        # key value
+        if block_plans is None:
+            block_plans = {}
+        self.block_plans = block_plans
 
-        # stack to keep track of which replacements are currently being
-        # processed (used to detect circular dependencies)
-        self.processing = set()
-        self.processed = {}
+        if key_value is None:
+            key_value = get_key_value(self.cfg["key_func"])
+        self.set_key_value(key_value)
 
-    def get_replacement(self, match):
-        name = match.groupdict()["name"]
-        retval = None
+    def set_key_value(self, key_value):
+        """
+            Set the key value to generate output for.
 
-        if name in self.processed:
-            retval = self.processed[name]
+            All state depending on the key value is reset, so that the same
+            generator can be used to render the parsed file for several keys.
+            Values of replacements not depending on the key value are shared
+            between keys (see `graph.ReplacementGraph`).
 
-        elif name in self.processing:
-            log.error("Replacement {}: Circular dependency detected!".format(name))
-            retval = ""
+            The key value is either a single key or a tuple of keys (most
+            specific first), see `keys.Groups.get_chain`.
+        """
+        self.key_value = key_value
+        self.resolver = self.graph.resolver(self.groups.get_chain(key_value))
 
-        else:
-            self.processing.add(name)
+    def get_replacement(self, name):
+        return self.resolver.resolve(name)
+
+    def compile(self, text):
+        return RenderPlan(self.replacement_t.matcher, text)
+
+    def process_text(self, text):
+        return self.compile(str(text)).render(self.get_replacement)
 
-            retval = self.processed[name] = self.process_text(
-                self.replacement_t(name)[self.key_value]
-            )
+    def iter_text(self):
+        """
+            Yield the generated text in chunks.
+        """
+        for i, tb in enumerate(self.text_blocks):
+            if tb.is_lazy():
+                # plans for blocks not kept in memory are not kept either
+                for text in tb.iter_text():
+                    with self.profile.phase("render"):
+                        plan = self.compile(text)
+                        rendered = plan.render(self.get_replacement)
+                    self.profile.add("replacements", len(plan.parts) // 2)
+                    yield rendered
+                continue
 
-            self.processing.remove(name)
+            with self.profile.phase("render"):
+                plan = self.block_plans.get(i)
+                if plan is None:
+                    (text,) = tb.iter_text()
+                    plan = self.block_plans[i] = self.compile(text)
+                rendered = plan.render(self.get_replacement)
+            self.profile.add("replacements", len(plan.parts) // 2)
+            yield rendered
 
-        return retval
+    def render(self):
+        """
+            Return the generated text.
+        """
+        return "".join(self.iter_text())
 
-    def process_text(self, text):
-        return self.replacement_t.matcher.sub(self.get_replacement, str(text))
+    def get_filename(self, subfolder=None):
+        """
+            Return the (resolved) output filename specified by the cfg (None
+            for stdout).
+
+            If `subfolder` is given, the file is placed in that subfolder of
+            the configured folder (used when rendering several keys).
+        """
+        if self.cfg["filename"] is None:
+            return None
+
+        folder = self.cfg["folder"]
+        if subfolder is not None:
+            folder = osp.join(folder, subfolder)
+        filename = osp.expanduser(
+            osp.expandvars(osp.join(folder, self.cfg["filename"]))
+        )
+        # write through symlinks instead of replacing them
+        return osp.realpath(filename)
 
-    def write(self):
+    def write(self, subfolder=None):
         """
             Write the generated text to the file specified by the cfg.
+
+            If `subfolder` is given, the file is placed in that subfolder of
+            the configured folder (used when rendering several keys).
+
+            The output file is only replaced (atomically) if its content would
+            change. Returns "updated", "unchanged" or "stdout". The hex digest
+            of the content is kept in `self.digest`.
         """
-        if self.cfg["filename"] is not None:
-            filename = osp.expanduser(
-                osp.expandvars(osp.join(self.cfg["folder"], self.cfg["filename"]))
-            )
-            log.info("Writing to output file {}".format(filename))
-        else:
-            filename = None
+        filename = self.get_filename(subfolder=subfolder)
+        self.digest = None
+
+        if filename is None:
             log.info("Writing to stdout.")
+            for text in self.iter_text():
+                sys.stdout.write(text)
+            return "stdout"
+
+        permissions = self.cfg["permissions"]
+
+        # the output is streamed so that large files never have to be kept in
+        # memory as a whole
+        update = self.output.update(filename, permissions=permissions)
+        digest = hashlib.sha1()
+        try:
+            for text in self.iter_text():
+                data = text.encode(m.DEFAULT_ENCODING)
+                self.profile.add("bytes_out", len(data))
+                update.write(data)
+                digest.update(data)
+        except BaseException:
+            update.abort()
+            raise
+        self.digest = digest.hexdigest()
+
+        if update.close():
+            self.output.add(filename, update.size)
+            log.info("Wrote output file {}".format(filename))
+            return "updated"
+
+        if permissions is not None and update.existing_permissions != permissions:
+            log.info("Updating permissions of {}".format(filename))
+            os.chmod(filename, permissions)
+            return "updated"
+
+        log.info("Output file {} is unchanged.".format(filename))
+        return "unchanged"
 
-        if filename is not None:
-            try:
-                os.makedirs(osp.dirname(filename))
-            except OSError:
-                pass
-            f = open(filename, "w")
+    def check(self, subfolder=None, diff=False):
+        """
+            Compare the generated text with the file specified by the cfg (see
+            `write`) without writing anything.
+
+            The generated text is compared with the existing file on the fly
+            (as by `misc.AtomicUpdate`) and only rendered as a whole if a diff
+            has to be printed (`diff` is set and the content would change).
+            Returns "updated" if `write` would update the file, otherwise
+            "unchanged".
+        """
+        filename = self.get_filename(subfolder=subfolder)
+
+        try:
+            existing = open(filename, "rb")
+        except OSError:
+            existing = None
+
+        if existing is None:
+            log.info("Output file {} would be created.".format(filename))
         else:
-            f = sys.stdout
+            with existing:
+                changed = False
+                for text in self.iter_text():
+                    data = text.encode(m.DEFAULT_ENCODING)
+                    if existing.read(len(data)) != data:
+                        changed = True
+                        break
+                else:
+                    # the existing file might be longer
+                    changed = existing.read(1) != b""
 
-        for tb in self.text_blocks:
-            f.write(self.process_text(os.linesep.join(tb.lines) + os.linesep))
+            if not changed:
+                permissions = self.cfg["permissions"]
+                if (
+                    permissions is not None
+                    and m.get_permissions(filename) != permissions
+                ):
+                    log.info("Permissions of {} would be updated.".format(filename))
+                    return "updated"
+                log.info("Output file {} is unchanged.".format(filename))
+                return "unchanged"
+            log.info("Output file {} would be updated.".format(filename))
+
+        if diff:
+            self.print_diff(filename, self.render(), exists=existing is not None)
+        return "updated"
+
+    def print_diff(self, filename, text, exists=True):
+        """
+            Print a unified diff from the file at `filename` to `text`.
+        """
+        # only needed for diffs
+        import difflib
 
-        if filename is not None:
-            f.close()
+        old_text = ""
+        if exists:
+            with open(filename, "rb") as f:
+                old_text = f.read().decode(m.DEFAULT_ENCODING, errors="replace")
 
-        if self.cfg["permissions"] is not None and filename is not None:
-            log.debug(
-                "Changing file permissions to {:o}".format(self.cfg["permissions"])
-            )
-            os.chmod(filename, self.cfg["permissions"])
+        lines = difflib.unified_diff(
+            old_text.splitlines(True),
+            text.splitlines(True),
+            fromfile=filename if exists else os.devnull,
+            tofile=filename,
+        )
+        for line in lines:
+            sys.stdout.write(line)
+            if not line.endswith("\n"):
+                sys.stdout.write("\n\\ No newline at end of file\n")
+        sys.stdout.flush()
@@ -0,0 +1,388 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2020 Oliver Breitwieser
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+    Dependency graph of the replacements of a parsed file.
+
+    The value of a replacement (for a given chain of keys, see `keys`) may
+    reference other replacements, which are then rendered first. Each chain
+    defines its own graph, but it only differs from the graph of the default
+    values in the replacements having a specific value for any key in the
+    chain and in those depending on them. All other values are rendered once
+    and shared by all chains.
+"""
+
+import threading
+
+from .keys import Groups
+from .logcfg import log
+from .plan import RenderPlan
+
+# chain under which the default values of replacements are resolved
+DEFAULT = object()
+
+
+def strongly_connected_components(roots, successors):
+    """
+        Return the strongly connected components of the graph reachable from
+        `roots` where `successors(node)` returns the nodes `node` points to
+        (Tarjan's algorithm, without recursion).
+    """
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    components = []
+
+    def visit(node):
+        index[node] = lowlink[node] = len(index)
+        stack.append(node)
+        on_stack.add(node)
+        return [node, iter(successors(node))]
+
+    for root in roots:
+        if root in index:
+            continue
+        work = [visit(root)]
+        while work:
+            node, it = work[-1]
+            for succ in it:
+                if succ not in index:
+                    work.append(visit(succ))
+                    break
+                elif succ in on_stack:
+                    lowlink[node] = min(lowlink[node], index[succ])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+    return components
+
+
+def find_cycle(start, members, successors):
+    """
+        Return the shortest cycle from `start` back to itself that only passes
+        through `members` (as list of nodes starting and ending with `start`).
+    """
+    parents = {}
+    todo = [start]
+    while todo:
+        next_todo = []
+        for node in todo:
+            for succ in successors(node):
+                if succ not in members or succ in parents:
+                    continue
+                parents[succ] = node
+                if succ == start:
+                    cycle = [start]
+                    node = parents[start]
+                    while node != start:
+                        cycle.append(node)
+                        node = parents[node]
+                    cycle.append(start)
+                    return cycle[::-1]
+                next_todo.append(succ)
+        todo = next_todo
+    return None
+
+
+class ReplacementGraph(object):
+    """
+        Dependency graph of all replacements registered in `replacement_t`.
+
+        The replacements must not be modified once the graph is created.
+    """
+
+    def __init__(self, replacement_t):
+        self.replacement_t = replacement_t
+        self.instances = replacement_t.instances
+
+        # value -> render plan (shared by all keys)
+        self.plans = {}
+
+        # key -> names of replacements with a specific value for the key
+        self.specific = {}
+        for name, repl in self.instances.items():
+            for key in repl:
+                self.specific.setdefault(key, set()).add(name)
+
+        # chain -> resolution table (see `get_table`)
+        self.tables = {}
+
+        # chains checked for circular dependencies (see `check_cycles`)
+        self.checked = set()
+
+        # name -> names of replacements whose default value references it
+        self.dependents = {}
+        for name in self.instances:
+            for dep in self.get_dependencies(name, DEFAULT):
+                self.dependents.setdefault(dep, set()).add(name)
+
+        self.shared = Resolver(self, DEFAULT)
+
+    def get_plan(self, value):
+        plan = self.plans.get(value)
+        if plan is None:
+            plan = self.plans[value] = RenderPlan(self.replacement_t.matcher, value)
+        return plan
+
+    def get_table(self, chain):
+        """
+            Return the resolution table for `chain` (a tuple of keys, most
+            specific first): the (unrendered) value of every replacement with a
+            specific value for any key in the chain.
+
+            It is only computed once per chain, so that looking up a value does
+            not depend on the length of the chain.
+        """
+        table = self.tables.get(chain)
+        if table is None:
+            table = {}
+            # values for less specific keys are overridden
+            for key in reversed(chain):
+                for name in self.specific.get(key, ()):
+                    table[name] = str(self.instances[name].get(key))
+            self.tables[chain] = table
+        return table
+
+    def get_value(self, name, chain):
+        """
+            Return the (unrendered) value of replacement `name` for `chain`.
+        """
+        repl = self.instances.get(name)
+        if repl is None:
+            return ""
+        if chain is not DEFAULT:
+            value = self.get_table(chain).get(name)
+            if value is not None:
+                return value
+        return str(repl.default)
+
+    def get_dependencies(self, name, chain):
+        return self.get_plan(self.get_value(name, chain)).names
+
+    def get_affected(self, chain):
+        """
+            Return the names of all replacements whose value for `chain`
+            differs from their default value.
+        """
+        affected = set(self.get_table(chain))
+        todo = list(affected)
+        while todo:
+            for dependent in self.dependents.get(todo.pop(), ()):
+                if dependent not in affected:
+                    affected.add(dependent)
+                    todo.append(dependent)
+        return affected
+
+    def resolver(self, chain):
+        """
+            Return a `Resolver` rendering the replacements for `chain`.
+        """
+        self.check_chain(chain)
+        return Resolver(
+            self, chain, affected=self.get_affected(chain), shared=self.shared
+        )
+
+    def find_cycles(self, chain=DEFAULT):
+        """
+            Return the circular dependencies in the graph for `chain` (one
+            cycle per group of mutually dependent replacements, as list of
+            names starting and ending with the same name).
+
+            For chains other than `DEFAULT`, only cycles involving a
+            replacement with a specific value for the chain are returned (all
+            others are cycles of the default values).
+        """
+        successors = lambda name: self.get_dependencies(name, chain)
+        if chain is DEFAULT:
+            roots = list(self.instances)
+            specific = None
+        else:
+            specific = self.get_table(chain)
+            roots = [name for name in self.instances if name in specific]
+
+        cycles = []
+        for component in strongly_connected_components(roots, successors):
+            members = set(component)
+            if specific is not None and members.isdisjoint(specific):
+                continue
+            start = min(component)
+            cycle = find_cycle(start, members, successors)
+            if cycle is not None:
+                cycles.append(cycle)
+        return cycles
+
+    def check_cycles(self, groups=None):
+        """
+            Log all circular dependencies (for the default values and the
+            chain of every single key that can make a difference: each key
+            with a specific value, each member of a group and each group in
+            `groups`, see `keys.Groups.get_chain`) and return their number.
+
+            Chains of other key values (tuples of keys) are only known once
+            they are rendered and checked then (see `resolver`).
+
+            When rendering, the reference closing a cycle is replaced by an
+            empty string.
+        """
+        if groups is None:
+            groups = Groups()
+
+        # cycle -> keys for which it exists
+        found = {}
+        for cycle in self.find_cycles(DEFAULT):
+            found[tuple(cycle)] = [DEFAULT]
+
+        key_values = set(self.specific) | set(groups.memberships) | set(groups.groups)
+        for key_value in sorted(key_values, key=str):
+            chain = groups.get_chain(key_value)
+            self.checked.add(chain)
+            for cycle in self.find_cycles(chain):
+                found.setdefault(tuple(cycle), []).append(key_value)
+
+        log_cycles(found)
+        return len(found)
+
+    def check_chain(self, chain):
+        """
+            Log all circular dependencies for `chain` unless it was checked
+            already.
+        """
+        if chain in self.checked:
+            return
+        self.checked.add(chain)
+        log_cycles(
+            {
+                tuple(cycle): [" > ".join(map(str, chain))]
+                for cycle in self.find_cycles(chain)
+            }
+        )
+
+
+def log_cycles(found):
+    """
+        Log the cycles in `found` (cycle -> keys for which it exists, see
+        `ReplacementGraph.check_cycles`).
+    """
+    for cycle, keys in found.items():
+        if keys[0] is DEFAULT:
+            where = ""
+        else:
+            where = " (key{}: {})".format(
+                "s" if len(keys) > 1 else "", ", ".join(map(str, keys))
+            )
+        log.error(
+            "Circular dependency between replacements{}: {}".format(
+                where, " -> ".join(cycle)
+            )
+        )
+
+
+class Resolver(object):
+    """
+        Renders the values of replacements for a single chain of keys (each
+        only once).
+
+        Values of replacements not in `affected` are taken from `shared`.
+
+        A resolver may be used from several threads at once (as the shared one
+        is).
+    """
+
+    def __init__(self, graph, chain, affected=None, shared=None):
+        self.graph = graph
+        self.chain = chain
+        self.affected = affected
+        self.shared = shared
+        self.values = {}
+        # reentrant since the lock is still held when resolving dependencies
+        self.lock = threading.RLock()
+
+    def _get(self, name):
+        """
+            Return the rendered value of `name` if it is known (None
+            otherwise).
+        """
+        if self.shared is not None and name not in self.affected:
+            return self.shared.resolve(name)
+        return self.values.get(name)
+
+    def _get_plan(self, name):
+        return self.graph.get_plan(self.graph.get_value(name, self.chain))
+
+    def resolve(self, name):
+        """
+            Return the rendered value of replacement `name`.
+        """
+        value = self._get(name)
+        if value is not None:
+            return value
+
+        with self.lock:
+            return self._resolve(name)
+
+    def _resolve(self, name):
+        # another thread might have rendered it in the meantime
+        value = self.values.get(name)
+        if value is not None:
+            return value
+
+        # render all dependencies first (depth first, so in topological
+        # order); replacements that are still being rendered are part of a
+        # cycle and are substituted by an empty string
+        active = {name}
+        stack = [[name, self._get_plan(name), 1]]
+        while stack:
+            entry = stack[-1]
+            current, plan, i = entry
+            parts = plan.parts
+            while i < len(parts) and (
+                parts[i] in active or self._get(parts[i]) is not None
+            ):
+                i += 2
+            entry[2] = i
+
+            if i < len(parts):
+                dep = parts[i]
+                active.add(dep)
+                stack.append([dep, self._get_plan(dep), 1])
+                continue
+
+            self.values[current] = plan.render(
+                lambda dep: "" if dep in active else self._get(dep)
+            )
+            active.remove(current)
+            stack.pop()
+
+        return self.values[name]
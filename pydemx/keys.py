@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2020 Oliver Breitwieser
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+    Key values and the chains of keys they are resolved with.
+
+    A key value is either a single key (e.g. the hostname) or a tuple of keys
+    (e.g. hostname, role, site), most specific first. Each key is followed by
+    the groups it is a member of (`cfg["groups"]`), so a replacement takes its
+    value from the first key in the chain it has a specific value for (host,
+    then its groups, then the site, ...) and falls back to its default.
+"""
+
+import threading
+import weakref
+
+
+class Groups(object):
+    """
+        Named groups of keys (group name -> members).
+
+        Memberships are computed once, groups defined first take precedence
+        for keys that are members of several groups. Instances are immutable
+        and therefore shared instead of copied.
+    """
+
+    def __init__(self, groups=None):
+        if groups is None:
+            groups = {}
+        self.groups = {name: tuple(members) for name, members in groups.items()}
+
+        # key -> names of all groups it is a member of
+        memberships = {}
+        for name, members in self.groups.items():
+            for member in members:
+                memberships.setdefault(member, []).append(name)
+        self.memberships = {k: tuple(v) for k, v in memberships.items()}
+
+        # key value -> chain
+        self._chains = {}
+
+    @classmethod
+    def from_cfg(cls, groups):
+        """
+            Return `groups` (as found in a cfg) as `Groups`.
+        """
+        if isinstance(groups, cls):
+            return groups
+        return cls(groups)
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __contains__(self, name):
+        return name in self.groups
+
+    def __len__(self):
+        return len(self.groups)
+
+    def get_groups(self, key):
+        return self.memberships.get(key, ())
+
+    def get_chain(self, key_value):
+        """
+            Return the chain of keys (tuple, most specific first) for
+            `key_value`.
+        """
+        if isinstance(key_value, list):
+            key_value = tuple(key_value)
+        chain = self._chains.get(key_value)
+        if chain is None:
+            keys = key_value if isinstance(key_value, tuple) else (key_value,)
+            chain = []
+            for key in keys:
+                for k in (key,) + self.get_groups(key):
+                    if k not in chain:
+                        chain.append(k)
+            chain = self._chains[key_value] = tuple(chain)
+        return chain
+
+
+# key function -> key value returned by it (see `get_key_value`); entries are
+# dropped along with the key function, so that the functions created for
+# each file (e.g. by its cfg) do not accumulate
+_key_values = weakref.WeakKeyDictionary()
+_key_values_lock = threading.Lock()
+
+
+def clear_cache():
+    """
+        Forget the key values returned by key functions so far.
+    """
+    with _key_values_lock:
+        _key_values.clear()
+
+
+def get_key_value(key_func):
+    """
+        Return the key value returned by `key_func`, which is only called once
+        per run (see `clear_cache`) as long as it exists.
+    """
+    try:
+        key_value = _key_values.get(key_func)
+    except TypeError:
+        # cannot be referenced weakly, hence not cached
+        return key_func()
+    if key_value is None:
+        key_value = key_func()
+        with _key_values_lock:
+            _key_values[key_func] = key_value
+    return key_value
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2020 Oliver Breitwieser
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+    Replacement libraries: `.pydemx` files defining replacements that are
+    shared by many templates (see `cfg["include"]`).
+
+    A library is tokenized, parsed and executed like a template (its text
+    blocks are not rendered though), but only once per process (and again
+    only if it changes). Its replacements are then defined in every template
+    including it, before those of the template itself.
+
+    Libraries may include other libraries themselves (circular includes are
+    reported and skipped).
+"""
+
+import os
+import threading
+import types
+
+from .config import Config, find_cfg_paths, get_prelude_path
+from .logcfg import log
+from .parser import Parser
+from .tokenizer import Tokenizer
+
+EMPTY = types.MappingProxyType({})
+
+# path -> (signature, included libraries, their replacements, replacements),
+# see `get_signature`
+_cache = {}
+# reentrant since loading a library loads the libraries it includes
+_cache_lock = threading.RLock()
+
+
+def clear_cache():
+    """
+        Forget all loaded libraries.
+    """
+    with _cache_lock:
+        _cache.clear()
+
+
+def get_signature(path):
+    """
+        Describe the library at `path` along with the cfg files and the prelude
+        it is parsed with (path, modification time and size of each), so that
+        it is parsed again if any of them changes.
+    """
+    paths = [path] + find_cfg_paths(path)
+    prelude_path = get_prelude_path(path)
+    if prelude_path is not None:
+        paths.append(prelude_path)
+    signature = []
+    for p in paths:
+        st = os.stat(p)
+        signature.append((p, st.st_mtime_ns, st.st_size))
+    return tuple(signature)
+
+
+def parse(path, cache=None, including=()):
+    """
+        Tokenize, parse and execute the library at `path` and return the paths
+        of the libraries it includes along with a read-only mapping of the
+        name of each replacement it defines (or includes) to its default value
+        and its specific values (by key).
+
+        `including` are the paths of the libraries (transitively) including
+        this one, which it must not include itself.
+
+        If `cache` (a `TemplateCache`) is given, the tokenized and parsed
+        state of the library is taken from/stored in it.
+    """
+    log.debug("Parsing library %s", path)
+    state = None
+    if cache is not None:
+        cache_key = cache.make_key(path, find_cfg_paths(path))
+        state = cache.load(cache_key)
+
+    if state is not None:
+        tokenizer = Tokenizer.from_state(state, source=path)
+    else:
+        tokenizer = Tokenizer.from_path(path)
+
+    if tokenizer.ignore_file:
+        if cache is not None and state is None:
+            cache.store(cache_key, tokenizer.get_state())
+        return [], EMPTY
+
+    cfg = Config(path, tokenizer.code_blocks[0])
+
+    including = including + (path,)
+    included = []
+    for include_path in cfg.include_paths:
+        if include_path in including:
+            log.error("Circular include of library {} by {}".format(include_path, path))
+            continue
+        included.append(include_path)
+    libraries = load_all(included, cache=cache, including=including)
+
+    if state is None:
+        if cache is not None:
+            # has to be retrieved prior to parsing because the parser modifies
+            # the text blocks
+            new_state = tokenizer.get_state()
+        parser = Parser(cfg, tokenizer, prelude=cfg.get_prelude(), libraries=libraries)
+        if cache is not None:
+            new_state["scans"] = parser.scans
+            cache.store(cache_key, new_state)
+    else:
+        parser = Parser(
+            cfg,
+            tokenizer,
+            scans=state["scans"],
+            prelude=cfg.get_prelude(),
+            libraries=libraries,
+        )
+
+    return included, types.MappingProxyType(
+        {
+            name: (repl.default, types.MappingProxyType(dict(repl)))
+            for name, repl in parser.replacement_t.instances.items()
+        }
+    )
+
+
+def _is_valid(entry, signature, cache, including):
+    """
+        Check if the cache `entry` of a library with `signature` is still valid,
+        i.e. neither the library nor the libraries it includes changed.
+    """
+    if entry is None or entry[0] != signature:
+        return False
+    _, included, libraries, _ = entry
+    return all(
+        load(path, cache=cache, including=including) is replacements
+        for path, replacements in zip(included, libraries)
+    )
+
+
+def load(path, cache=None, including=()):
+    """
+        Return the (cached) replacements of the library at `path` (see
+        `parse`).
+    """
+    signature = get_signature(path)
+    including = including + (path,)
+    entry = _cache.get(path)
+    if _is_valid(entry, signature, cache, including):
+        return entry[3]
+
+    # only parse once even if several threads need the library at once
+    with _cache_lock:
+        entry = _cache.get(path)
+        if _is_valid(entry, signature, cache, including):
+            return entry[3]
+        included, replacements = parse(path, cache=cache, including=including[:-1])
+        libraries = [_cache[p][3] for p in included]
+        _cache[path] = (signature, included, libraries, replacements)
+    return replacements
+
+
+def load_all(paths, cache=None, including=()):
+    """
+        Return the replacements of all libraries at `paths` (in order).
+    """
+    return [load(path, cache=cache, including=including) for path in paths]
+
+
+def get_included(paths):
+    """
+        Return the paths of all libraries (transitively) included by the
+        libraries at `paths` (which have to be loaded).
+    """
+    found = []
+    todo = list(paths)
+    while todo:
+        path = todo.pop(0)
+        entry = _cache.get(path)
+        if entry is None:
+            continue
+        for included in entry[1]:
+            if included not in found:
+                found.append(included)
+                todo.append(included)
+    return found
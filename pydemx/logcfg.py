@@ -21,8 +21,10 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+import contextvars
 import logging
 import os
+from contextlib import contextmanager
 
 LOGNAME = "pyDeMX"
 log = None
@@ -34,6 +36,10 @@ default_verbose_formatter = logging.Formatter(
 default_formatter = logging.Formatter(
     "%(asctime)s %(levelname)s: " "%(message)s", datefmt="%y-%m-%d %H:%M:%S"
 )
+# used for all records emitted while a file is being processed
+file_formatter = logging.Formatter(
+    "%(asctime)s %(pydemx_file)s: " "%(message)s", datefmt="%y-%m-%d %H:%M:%S"
+)
 
 
 formatter_in_use = default_formatter  # allows switching of the global formatter
@@ -47,6 +53,184 @@ log.setLevel(getattr(logging, loglevel_in_use))
 default_handler_stream = None
 default_handler_file = None
 
+# the file currently being processed (see `file_context`), kept per thread
+# (and task) so that files can be processed concurrently
+current_file = contextvars.ContextVar("pydemx_file", default=None)
+
+
+class FileContextFilter(logging.Filter):
+    """
+        Attaches the file currently being processed to every record.
+    """
+
+    def filter(self, record):
+        filename = current_file.get()
+        if filename is not None and not hasattr(record, "pydemx_file"):
+            record.pydemx_file = filename
+        return True
+
+
+log.addFilter(FileContextFilter())
+
+
+class FileContextFormatter(logging.Formatter):
+    """
+        Formats records emitted while processing a file with `file_formatter`
+        and all other records with the wrapped formatter.
+    """
+
+    def __init__(self, formatter):
+        super(FileContextFormatter, self).__init__()
+        self.formatter = formatter
+
+    def format(self, record):
+        if getattr(record, "pydemx_file", None) is not None:
+            return file_formatter.format(record)
+        else:
+            return self.formatter.format(record)
+
+
+class ListHandler(logging.Handler):
+    """
+        Collects records in a list (so they can be emitted elsewhere).
+    """
+
+    def __init__(self, records):
+        super(ListHandler, self).__init__()
+        self.records = records
+
+    def emit(self, record):
+        # make sure the record can be pickled
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        self.records.append(record)
+
+
+class TraceHandler(logging.Handler):
+    """
+        Writes every record to `filename` as JSON object (one per line), with
+        the message template and its arguments kept apart (see
+        `start_trace`).
+    """
+
+    def __init__(self, filename):
+        super(TraceHandler, self).__init__(logging.DEBUG)
+        # only needed when tracing
+        import json
+
+        self.dumps = json.dumps
+        self.stream = open(filename, "w")
+
+    def emit(self, record):
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "file": getattr(record, "pydemx_file", None),
+            "process": record.process,
+            "thread": record.threadName,
+            "location": "{}:{}".format(record.pathname, record.lineno),
+            "function": record.funcName,
+            "message": record.getMessage(),
+        }
+        # records of worker processes are already formatted (see ListHandler)
+        if record.args:
+            entry["template"] = str(record.msg)
+            entry["args"] = [str(arg) for arg in record.args]
+        if record.exc_info:
+            entry["exception"] = logging.Formatter().formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        self.stream.write(self.dumps(entry) + "\n")
+
+    def close(self):
+        self.stream.close()
+        super(TraceHandler, self).close()
+
+
+def start_trace(filename):
+    """
+        Write all records of `log` (including debug records) to `filename`
+        (see `TraceHandler`) until `stop_trace` is called with the returned
+        handler.
+
+        All other handlers keep their levels, so only the trace gets the
+        additional records.
+    """
+    handler = TraceHandler(filename)
+    handler.previous_level = log.level
+    log.setLevel(logging.DEBUG)
+    log.addHandler(handler)
+    return handler
+
+
+def stop_trace(handler):
+    log.removeHandler(handler)
+    log.setLevel(handler.previous_level)
+    handler.close()
+
+
+@contextmanager
+def file_context(filename):
+    """
+        All records emitted within the context are marked as belonging to
+        `filename`.
+    """
+    token = current_file.set(filename)
+    try:
+        yield
+    finally:
+        current_file.reset(token)
+
+
+@contextmanager
+def capture_records():
+    """
+        Collect all records of `log` in the yielded list instead of passing
+        them to the handlers.
+    """
+    records = []
+    handlers = log.handlers
+    log.handlers = [ListHandler(records)]
+    try:
+        yield records
+    finally:
+        log.handlers = handlers
+
+
+@contextmanager
+def redirect_output(stream):
+    """
+        Emit all records of the default stream handler to `stream`, starting
+        with the default log levels and formatters, and restore the previous
+        ones when leaving the context.
+    """
+    global formatter_in_use, loglevel_in_use
+    saved = (
+        formatter_in_use,
+        loglevel_in_use,
+        log.level,
+        [(h, h.level, h.formatter) for h in log.handlers],
+    )
+    formatter_in_use = default_formatter
+    loglevel_in_use = "WARN"
+    set_loglevel(log, loglevel_in_use)
+    for h in log.handlers:
+        set_loglevel(h, loglevel_in_use)
+        h.setFormatter(FileContextFormatter(formatter_in_use))
+    previous_stream = default_handler_stream.setStream(stream)
+    try:
+        yield
+    finally:
+        default_handler_stream.setStream(previous_stream)
+        formatter_in_use, loglevel_in_use, level, handlers = saved
+        log.setLevel(level)
+        for h, level, formatter in handlers:
+            h.setLevel(level)
+            h.setFormatter(formatter)
+
 
 def set_loglevel(lg, lvl):
     lg.setLevel(getattr(logging, lvl.upper()))
@@ -72,7 +256,7 @@ def add_handler(type_, handler_kwargs=None, loglevel=None, formatter=None):
     if loglevel is None:
         loglevel = loglevel_in_use
 
-    handler.setFormatter(formatter)
+    handler.setFormatter(FileContextFormatter(formatter))
     set_loglevel(handler, loglevel)
     log.addHandler(handler)
     return handler
@@ -107,7 +291,7 @@ def make_verbose():
     set_loglevel(log, verbose_loglevel)
     for h in log.handlers:
         set_loglevel(h, verbose_loglevel)
-        h.setFormatter(default_verbose_formatter)
+        h.setFormatter(FileContextFormatter(default_verbose_formatter))
 
 
 if "DEBUG" in os.environ:
@@ -117,6 +301,3 @@ default_handler_stream = add_stream_handler(loglevel=loglevel_in_use)
 
 if "DEBUG" in os.environ:
     make_verbose()
-
-for i in range(3):
-    log.debug("-" * 80)
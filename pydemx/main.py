@@ -23,32 +23,56 @@
 
 
 import sys
+import hashlib
 import os
 import os.path as osp
-import docopt
-import logging
-from pprint import pformat as pf
 
-from .config import Config
+from .cache import TemplateCache
+from .config import Config, find_cfg_paths
+from .deps import DependencyStore
+from . import profiling
+from .profiling import NO_PROFILE
+from . import config
+from . import library
 from .tokenizer import Tokenizer
 from .parser import Parser
 from .generator import Generator
+from .manifest import Manifest, STATES, describe_output
+from .output import OutputWriter
+from .keys import get_key_value
+from .walk import Walker
 from . import logcfg
 from .logcfg import log
+from .misc import LazyPf
 
 raw_docstring = """
 
 Usage:
     {prog} [-v ...] [options] <file_or_folder>...
+    {prog} [-v ...] [--socket <path>] --daemon
+    {prog} --client <argument>...
 
 Agruments:
     <file_or_folder>
         If argument is a filename it will be converted; if it is a foldername,
         {prog} converts all `.pydemx` files contained within it.
 
+    <argument>
+        Arguments to pass on to the daemon (see --client).
+
 Options:
     -r --recursive
         Recurse into subfolders of specified folders. Does NOT recurse files.
+        Version control and dependency folders (.git, node_modules, ...) as
+        well as everything matched by patterns in `.pydemxignore` files
+        (same syntax as `.gitignore`) are skipped.
+
+    --no-ignore
+        Do not skip any folders or files when searching specified folders.
+
+    --scan-threads <n>
+        Scan folders in <n> parallel threads (helps on network filesystems).
+        [default: 1]
 
     -c --current-folder
         Force output into the current folder. The resulting filename will be
@@ -58,6 +82,17 @@ Options:
     -k --key-value <key>
         Overwrite the key-value returned by the key-function.
 
+    -K --keys-from <keyfile>
+        Render each file once for every key listed in <keyfile> (one key per
+        line, empty lines and lines starting with `#` are ignored). Every file
+        is only tokenized and parsed once. The output for each key is placed
+        in a subfolder named after the key (path separators are replaced by
+        `_`, the keys `.` and `..` are not allowed).
+
+    -a --all-keys
+        Like --keys-from, but render for every key for which any replacement
+        in the file defines a specific value.
+
     -e --extension <ext>
         Specify a different extention for input files. [default: .pydemx]
 
@@ -67,31 +102,199 @@ Options:
     -q --silent
         Suppress output.
 
+    -j --jobs <n>
+        Convert files in <n> parallel worker processes (0: one per CPU).
+        Ignored with --print-to-stdout and --diff so that the output keeps
+        the order of the files. [default: 1]
+
     -o --print-to-stdout
         Print the generated config files to stdout instead of generating any
         config files.
+
+    --check
+        Render all files in memory and only report which output files would
+        be updated (exits with 1 if any would).
+
+    --diff
+        Like --check, but also print a unified diff for each output file that
+        would be updated.
+
+    --status
+        Instead of converting, list the output files generated from the given
+        files (or files in the given folders, recursively) along with their
+        state (ok, outdated, modified, missing or stale), as recorded in the
+        manifest of generated files.
+
+    --clean
+        Instead of converting, remove all stale output files of the given
+        files (or files in the given folders, recursively), i.e. outputs that
+        are no longer generated because the file was removed or its output
+        filename changed. Stale outputs modified since they were generated are
+        kept.
+
+    -w --watch
+        Keep running and re-convert files whenever they (or a cfg file they
+        depend on) change. New files in the given folders are picked up as
+        well.
+
+    -f --force
+        Convert all files. By default, files are skipped if neither they, their
+        cfg files nor the key value changed since their last conversion and
+        their outputs are untouched.
+
+    --fsync
+        Flush all written output files to disk at the end of the run.
+
+    --no-cache
+        Do not use the cache of tokenized and parsed files (stored in
+        $PYDEMX_CACHE_DIR or $XDG_CACHE_HOME/pydemx).
+
+    --daemon
+        Keep running and convert files for clients (see --client) connecting
+        to the socket at $PYDEMX_SOCKET, $XDG_RUNTIME_DIR/pydemx.sock or
+        /tmp/pydemx-<uid>.sock. Tokenized and parsed files as well as cfg
+        files are kept in memory (until they change).
+
+    --socket <path>
+        Listen on <path> instead (with --daemon).
+
+    --client
+        Let the daemon run {prog} with the remaining arguments (in the current
+        folder and environment). Must be the first argument. If no daemon is
+        running, the arguments are handled without it.
+
+    --profile <file>
+        Write the time spent in each phase of converting a file, the number
+        of bytes read and written, the number of substituted replacements and
+        the peak of traced memory allocations to <file> (one JSON object per
+        line and file). Slows down the conversion.
+
+    --trace <file>
+        Write all log records, including the debug records that are otherwise
+        not shown, to <file> (one JSON object per line holding the file being
+        converted, the source location and the message along with its
+        unformatted arguments). Slows down the conversion.
 """
 
 from .version import __version__
 
 
-def get_updated_docstring():
-    return raw_docstring.format(prog=osp.basename(sys.argv[0]))
-
+def get_updated_docstring(prog=None):
+    if prog is None:
+        prog = sys.argv[0]
+    return raw_docstring.format(prog=osp.basename(prog))
 
-def parse_file(filename, args):
-    fileformatter = logging.Formatter(
-        "%(asctime)s {}: " "%(message)s".format(filename), datefmt="%y-%m-%d %H:%M:%S"
-    )
-    log.handlers[0].setFormatter(fileformatter)
 
+def read_keys(filename):
+    """
+        Read key values from file, one per line.
+    """
     with open(filename, "r") as f:
-        tokenizer = Tokenizer(f)
+        lines = (line.strip() for line in f)
+        return [line for line in lines if len(line) > 0 and not line.startswith("#")]
+
+
+def get_subfolder(key):
+    """
+        Return the name of the subfolder the outputs for `key` are placed in.
+
+        Path separators are replaced, keys that would not name a subfolder of
+        their own ("", "." and "..") are rejected (ValueError).
+    """
+    subfolder = str(key)
+    for sep in filter(None, [os.sep, os.altsep]):
+        subfolder = subfolder.replace(sep, "_")
+    if subfolder in ("", os.curdir, os.pardir):
+        raise ValueError("Key {!r} cannot be used as subfolder.".format(key))
+    return subfolder
+
+
+def get_signature(args, keys=None):
+    """
+        Describe the key(s) and options a file is converted with (see
+        `DependencyStore`). Returns None if the outputs cannot be reused.
+    """
+    if args["--print-to-stdout"]:
+        return None
+
+    if keys is not None:
+        digest = hashlib.sha1(os.linesep.join(keys).encode("utf-8")).hexdigest()
+        key_signature = ("keys", digest)
+    elif args["--all-keys"]:
+        key_signature = ("all-keys",)
+    elif args["--key-value"] is not None:
+        key_signature = ("key", args["--key-value"])
+    else:
+        key_signature = ("key", str(get_key_value(config.get_defaults()["key_func"])))
+
+    return key_signature + (bool(args["--current-folder"]),)
+
+
+def parse_file(
+    filename,
+    args,
+    keys=None,
+    cache=None,
+    deps=None,
+    profile=NO_PROFILE,
+    output=None,
+):
+    """
+        Convert a single file.
+
+        If `keys` is given, the file is rendered for each of the keys (into a
+        subfolder named after the key) while only being tokenized and parsed
+        once.
+
+        If `cache` (a `TemplateCache`) is given, the tokenized and parsed
+        state of the file is taken from/stored in it.
+
+        If `deps` (a `DependencyStore`) is given, the inputs and outputs of
+        the conversion are recorded in it.
+
+        The time spent in each phase is recorded in `profile` (a
+        `profiling.FileProfile`).
+
+        Output files are written via `output` (an `output.OutputWriter`),
+        which also collects their manifest entries (see `manifest`).
+
+        Returns None if the file was ignored, otherwise the list of results
+        of `Generator.write` for all written outputs.
+    """
+    st = os.stat(filename)
+    profile.add("bytes_in", st.st_size)
+
+    snapshot = None
+    if deps is not None and not is_check(args):
+        # describe the inputs before reading them
+        with profile.phase("deps"):
+            snapshot = deps.snapshot(filename)
+        # as checked by `process_file` (`keys` is replaced with --all-keys)
+        signature = get_signature(args, keys)
+
+    state = None
+    if cache is not None:
+        with profile.phase("cache"):
+            cache_key = cache.make_key(filename, find_cfg_paths(filename))
+            state = cache.load(cache_key)
+
+    with profile.phase("tokenize"):
+        if state is not None:
+            tokenizer = Tokenizer.from_state(state, source=filename)
+        else:
+            tokenizer = Tokenizer.from_path(filename)
 
     if tokenizer.ignore_file:
-        return
-
-    cfg = Config(filename, tokenizer.code_blocks[0])
+        if cache is not None and state is None:
+            with profile.phase("cache"):
+                cache.store(cache_key, tokenizer.get_state())
+        if snapshot is not None:
+            with profile.phase("deps"):
+                deps.record(filename, signature, snapshot)
+        return None
+
+    with profile.phase("config"):
+        cfg = Config(filename, tokenizer.code_blocks[0])
     if cfg["folder"] is None or args["--current-folder"]:
         cfg["folder"] = osp.dirname(osp.abspath(filename))
 
@@ -104,22 +307,331 @@ def parse_file(filename, args):
     key_value = args["--key-value"]
     if key_value is not None:
         log.info("Setting key-value to: {}".format(key_value))
-        parser.config["key_func"] = lambda: key_value
+        cfg["key_func"] = lambda: key_value
+
+    if snapshot is not None:
+        with profile.phase("deps"):
+            deps.add_included(snapshot, cfg.include_paths)
+
+    with profile.phase("parse"):
+        libraries = library.load_all(cfg.include_paths, cache=cache)
+
+    if snapshot is not None:
+        with profile.phase("deps"):
+            # libraries included by libraries are only known once loaded
+            deps.add_included(snapshot, library.get_included(cfg.include_paths))
+
+    if state is None:
+        if cache is not None:
+            # has to be retrieved prior to parsing because the parser modifies
+            # the text blocks
+            with profile.phase("cache"):
+                new_state = tokenizer.get_state()
+        with profile.phase("parse"):
+            parser = Parser(
+                cfg, tokenizer, prelude=cfg.get_prelude(), libraries=libraries
+            )
+        if cache is not None:
+            new_state["scans"] = parser.scans
+            with profile.phase("cache"):
+                cache.store(cache_key, new_state)
+    else:
+        with profile.phase("parse"):
+            parser = Parser(
+                cfg,
+                tokenizer,
+                scans=state["scans"],
+                prelude=cfg.get_prelude(),
+                libraries=libraries,
+            )
+
+    if keys is None and args["--all-keys"]:
+        keys = parser.get_keys()
+
+    generator = Generator(cfg, parser, profile=profile, output=output)
+
+    def write(subfolder=None):
+        if is_check(args):
+            return generator.check(subfolder=subfolder, diff=args["--diff"])
+        result = generator.write(subfolder=subfolder)
+        if generator.digest is not None:
+            generator.output.add_generated(
+                describe_output(
+                    generator.get_filename(subfolder=subfolder),
+                    osp.abspath(filename),
+                    str(generator.key_value),
+                    generator.digest,
+                    st.st_mtime_ns,
+                )
+            )
+        return result
+
+    if keys is None:
+        with profile.phase("write"):
+            written = [write()]
+        outputs = [generator.get_filename()]
+    else:
+        written = []
+        outputs = []
+        # fail before writing any output
+        subfolders = [get_subfolder(key) for key in keys]
+        for key, subfolder in zip(keys, subfolders):
+            log.info("Rendering for key: {}".format(key))
+            generator.set_key_value(key)
+            with profile.phase("write"):
+                written.append(write(subfolder=subfolder))
+            outputs.append(generator.get_filename(subfolder=subfolder))
+
+    if snapshot is not None:
+        if (
+            not args["--all-keys"]
+            and keys is None
+            and key_value is None
+            and cfg["key_func"] is not config.get_defaults()["key_func"]
+        ):
+            # a custom key function might return anything on the next run
+            signature = None
+        with profile.phase("deps"):
+            deps.record(filename, signature, snapshot, outputs=outputs)
+
+    return written
+
+
+def is_check(args):
+    """
+        Check if outputs should only be compared instead of written.
+    """
+    return args["--check"] or args["--diff"]
+
+
+def process_file(
+    filename, args, keys=None, cache=None, deps=None, profile=False, output=None
+):
+    """
+        Convert a single file (see `parse_file`) and report the outcome as one
+        of "converted", "up-to-date", "ignored" or "failed" along with the list
+        of results for all written outputs and the profile record of the file
+        (None unless `profile` is set, see `profiling.FileProfile`).
+
+        If `deps` (a `DependencyStore`) is given, files whose inputs did not
+        change since their last conversion are skipped (unless --force).
+    """
+    file_profile = profiling.FileProfile(filename) if profile else NO_PROFILE
+
+    def result(outcome, written=()):
+        record = file_profile.get_record(outcome) if profile else None
+        return outcome, list(written), record
+
+    with logcfg.file_context(filename):
+        if deps is not None and not args["--force"]:
+            with file_profile.phase("deps"):
+                up_to_date = deps.is_up_to_date(filename, get_signature(args, keys))
+            if up_to_date:
+                log.info("Up to date.")
+                return result("up-to-date")
+
+        try:
+            written = parse_file(
+                filename,
+                args,
+                keys=keys,
+                cache=cache,
+                deps=deps,
+                profile=file_profile,
+                output=output,
+            )
+        except Exception:
+            log.exception("Conversion failed.")
+            return result("failed")
+
+    if written is None:
+        return result("ignored")
+    else:
+        return result("converted", written)
+
+
+# state of worker processes (set by `_init_worker`)
+_worker_setup = None
+
+
+def _init_worker(loglevel, args, keys, cache, deps, profile):
+    global _worker_setup
+    log.setLevel(loglevel)
+    if profile:
+        profiling.start()
+    _worker_setup = (args, keys, cache, deps, profile, OutputWriter())
+
+
+def _process_file_in_worker(filename):
+    args, keys, cache, deps, profile, output = _worker_setup
+    # records are emitted by the main process so that the output of each file
+    # stays together
+    with logcfg.capture_records() as records:
+        result = process_file(
+            filename,
+            args,
+            keys=keys,
+            cache=cache,
+            deps=deps,
+            profile=profile,
+            output=output,
+        )
+    return result, records, output.drain()
+
+
+def process_files(
+    filenames,
+    args,
+    jobs=1,
+    keys=None,
+    cache=None,
+    deps=None,
+    profile=False,
+    output=None,
+):
+    """
+        Convert all files (in `jobs` worker processes if `jobs` > 1) and return
+        the result (see `process_file`) for each file in order.
+
+        All written files are added to `output` (an `output.OutputWriter`).
+    """
+    if output is None:
+        output = OutputWriter()
+
+    if jobs <= 1 or len(filenames) <= 1:
+        return [
+            process_file(
+                filename,
+                args,
+                keys=keys,
+                cache=cache,
+                deps=deps,
+                profile=profile,
+                output=output,
+            )
+            for filename in filenames
+        ]
+
+    import multiprocessing
+
+    results = []
+    chunksize = max(1, len(filenames) // (jobs * 8))
+    with multiprocessing.Pool(
+        processes=jobs,
+        initializer=_init_worker,
+        initargs=(log.level, args, keys, cache, deps, profile),
+    ) as pool:
+        for result, records, (written, generated) in pool.imap(
+            _process_file_in_worker, filenames, chunksize=chunksize
+        ):
+            for record in records:
+                log.handle(record)
+            results.append(result)
+            output.extend(written, generated)
+    return results
+
+
+def is_template(path, ext):
+    """
+        Check if the (existing) file at path should be converted when found in
+        a folder.
+    """
+    base, file_ext = osp.splitext(path)
+    return file_ext == ext and osp.basename(base) != "cfg"
+
+
+def print_status(status):
+    """
+        Print the state of each output (as returned by `Manifest.status`) and
+        log a summary.
+    """
+    for state, entry in status:
+        output, template, key = entry[:3]
+        print("{:<9} {} ({} @ {})".format(state, output, template, key))
+
+    states = [state for state, _ in status]
+    log.info(
+        "{} output files: {}.".format(
+            len(states),
+            ", ".join(
+                "{} {}".format(states.count(state), state)
+                for state in STATES
+                if state in states
+            )
+            or "none recorded",
+        )
+    )
+    return 0
+
+
+def summarize(results, check=False, written_files=()):
+    """
+        Log a summary of the results returned by `process_files` (and of the
+        `written_files` as returned by `OutputWriter.finish`) and return the
+        corresponding exit code.
+
+        If `check` is set, the outputs were only compared and the exit code is
+        1 if any of them would be updated.
+    """
+    outcomes = [outcome for outcome, _, _ in results]
+    written = [w for _, written, _ in results for w in written]
+
+    num_failed = outcomes.count("failed")
+    log.info(
+        "Processed {} files: {} converted, {} up to date, {} ignored, "
+        "{} failed.".format(
+            len(outcomes),
+            outcomes.count("converted"),
+            outcomes.count("up-to-date"),
+            outcomes.count("ignored"),
+            num_failed,
+        )
+    )
+    log.info(
+        "Output files: {} {}updated, {} unchanged.".format(
+            written.count("updated"),
+            "would be " if check else "",
+            written.count("unchanged"),
+        )
+    )
 
-    parser = Parser(cfg, tokenizer)
+    if written_files:
+        log.info(
+            "Wrote {} bytes to {} files.".format(
+                sum(size for _, size in written_files), len(written_files)
+            )
+        )
 
-    generator = Generator(cfg, parser)
-    generator.write()
+    if num_failed > 0 or (check and "updated" in written):
+        return 1
+    return 0
 
-    log.handlers[0].setFormatter(logcfg.formatter_in_use)
 
+def main_loop(argv=None, daemon=None):
+    """
+        Run pydemx with the command line `argv`.
 
-def main_loop(argv=None):
+        `daemon` is the `daemon.Daemon` running the command line (if any).
+    """
     if argv is None:
         argv = sys.argv
 
+    if argv[1:2] == ["--client"]:
+        if daemon is not None:
+            # the daemon would wait for itself
+            log.error("Cannot run a client from within the daemon.")
+            return 1
+        from .client import main
+
+        return main(argv[:1] + argv[2:])
+
+    # imported here so that importing this module stays cheap
+    import docopt
+
     args = docopt.docopt(
-        get_updated_docstring(), argv=argv[1:], version=".".join(map(str, __version__))
+        get_updated_docstring(argv[0]),
+        argv=argv[1:],
+        version=".".join(map(str, __version__)),
     )
 
     if not args["--silent"]:
@@ -128,27 +640,129 @@ def main_loop(argv=None):
             logcfg.set_loglevel(h, "INFO")
     elif args["--verbose"] > 0:
         logcfg.make_verbose()
-        log.debug(pf(args))
+        log.debug("%s", LazyPf(args))
+
+    if args["--daemon"]:
+        if daemon is not None:
+            log.error("Cannot start a daemon from within the daemon.")
+            return 1
+        from .daemon import Daemon
+
+        return Daemon(args["--socket"]).serve()
+
+    if args["--status"] or args["--clean"]:
+        manifest = Manifest()
+        try:
+            if args["--status"]:
+                return print_status(manifest.status(args["<file_or_folder>"]))
+            num_removed = manifest.clean(args["<file_or_folder>"])
+            log.info("Removed {} stale output files.".format(num_removed))
+            return 0
+        finally:
+            manifest.close()
+
+    if daemon is not None and args["--watch"]:
+        log.error("--watch cannot be used with --client.")
+        return 1
 
     ext = args["--extension"]
-    recursive = args["--recursive"]
-
-    files_and_folders = []
-    files_and_folders.extend(args["<file_or_folder>"])
-
-    for faf in files_and_folders:
-        if osp.isfile(faf):
-            parse_file(faf, args)
-        elif osp.isdir(faf):
-            for entry in os.listdir(faf):
-                path = osp.join(faf, entry)
-
-                valid_file = (
-                    osp.isfile(path)
-                    and osp.splitext(path)[-1] == ext
-                    and osp.basename(osp.splitext(path)[0]) != "cfg"
-                )
-                valid_folder = recursive and osp.isdir(path)
+    walker = Walker(
+        lambda path: is_template(path, ext),
+        recursive=args["--recursive"],
+        ignore=not args["--no-ignore"],
+        jobs=int(args["--scan-threads"]),
+    )
 
-                if valid_file or valid_folder:
-                    files_and_folders.append(path)
+    if args["--no-cache"]:
+        cache = None
+    elif daemon is not None:
+        cache = daemon.cache
+    else:
+        cache = TemplateCache()
+    deps = DependencyStore()
+
+    keys = None
+    if args["--keys-from"] is not None:
+        keys = read_keys(args["--keys-from"])
+        log.info("Read {} keys from {}".format(len(keys), args["--keys-from"]))
+        try:
+            for key in keys:
+                get_subfolder(key)
+        except ValueError as e:
+            log.error(str(e))
+            return 1
+
+    jobs = int(args["--jobs"])
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+    if is_check(args) and args["--print-to-stdout"]:
+        log.error("--check/--diff cannot be used with --print-to-stdout.")
+        return 1
+
+    if args["--print-to-stdout"] or args["--diff"]:
+        # output of worker processes would be interleaved in arbitrary order
+        # (and would not reach the client of a daemon)
+        jobs = 1
+
+    profile_writer = None
+    if args["--profile"] is not None:
+        profiling.start()
+        profile_writer = profiling.ProfileWriter(args["--profile"])
+
+    trace = None
+    if args["--trace"] is not None:
+        try:
+            trace = logcfg.start_trace(args["--trace"])
+        except OSError as e:
+            log.error("Cannot write trace: {}".format(e))
+            return 1
+
+    output = OutputWriter(fsync=args["--fsync"])
+    manifest = Manifest()
+
+    def convert(filenames):
+        results = process_files(
+            filenames,
+            args,
+            jobs=jobs,
+            keys=keys,
+            cache=cache,
+            deps=deps,
+            profile=profile_writer is not None,
+            output=output,
+        )
+        written_files, generated = output.finish()
+        try:
+            if not is_check(args):
+                manifest.update(
+                    generated,
+                    ignored=[
+                        osp.abspath(filename)
+                        for filename, (outcome, _, _) in zip(filenames, results)
+                        if outcome == "ignored"
+                    ],
+                )
+        except Exception as e:
+            log.warn("Could not update the manifest: {}".format(e))
+        if profile_writer is not None:
+            for _, _, record in results:
+                profile_writer.write(record)
+        return summarize(results, check=is_check(args), written_files=written_files)
+
+    try:
+        exit_code = convert(walker.find_files(args["<file_or_folder>"]))
+
+        if args["--watch"]:
+            from .watch import Watcher
+
+            watcher = Watcher(args["<file_or_folder>"], walker, convert, deps=deps)
+            watcher.run()
+    finally:
+        manifest.close()
+        if trace is not None:
+            logcfg.stop_trace(trace)
+        if profile_writer is not None:
+            profile_writer.close()
+            profiling.stop()
+
+    return exit_code
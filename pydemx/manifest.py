@@ -0,0 +1,387 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2020 Oliver Breitwieser
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+    Manifest of all generated output files.
+
+    For every output file, the template it was generated from, the key it was
+    rendered for and a hash of its contents are stored in an SQLite database
+    (in the data folder, one per root, see `find_root`), so that the state of
+    all outputs below a folder can be reported and stale outputs removed
+    without rendering or searching for them.
+"""
+
+import hashlib
+import os
+import os.path as osp
+
+from .config import find_cfg_paths
+from .logcfg import log
+from . import misc as m
+
+DATA_ENV_FOLDER = "PYDEMX_DATA_DIR"
+
+MANIFEST_SUFFIX = ".sqlite"
+
+# bump whenever the schema changes
+MANIFEST_FORMAT = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS root (
+    path TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outputs (
+    output TEXT PRIMARY KEY,
+    template TEXT NOT NULL,
+    key TEXT,
+    digest TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    template_mtime_ns INTEGER NOT NULL,
+    -- set once the template no longer generates the output
+    stale INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS outputs_template ON outputs (template);
+"""
+
+COLUMNS = "output, template, key, digest, size, mtime_ns, template_mtime_ns, stale"
+
+# folders marking the root of a version control checkout
+VCS_NAMES = (".git", ".hg", ".svn", ".bzr", "_darcs")
+
+# states reported by `Manifest.status`
+STATES = [
+    # output as generated
+    "ok",
+    # template changed since the output was generated
+    "outdated",
+    # output was changed by someone else
+    "modified",
+    # output was removed
+    "missing",
+    # template no longer generates the output (or was removed)
+    "stale",
+]
+
+
+def describe_output(output, template, key, digest, template_mtime_ns):
+    """
+        Return the entry of a generated output as passed to `Manifest.update`.
+    """
+    st = os.stat(output)
+    return (
+        output,
+        template,
+        key,
+        digest,
+        st.st_size,
+        st.st_mtime_ns,
+        template_mtime_ns,
+    )
+
+
+def get_data_folder():
+    """
+        Return the folder in which the manifests are stored.
+
+        Honors $PYDEMX_DATA_DIR and $XDG_DATA_HOME (in that order).
+    """
+    folder = os.environ.get(DATA_ENV_FOLDER)
+    if folder:
+        return folder
+    base = os.environ.get("XDG_DATA_HOME") or osp.join(
+        osp.expanduser("~"), ".local", "share"
+    )
+    return osp.join(base, "pydemx")
+
+
+def find_root(path):
+    """
+        Return the root of the tree the template at `path` belongs to: the
+        nearest version control checkout containing it, otherwise the folder
+        of its topmost cfg file (or its own folder if there is none).
+    """
+    folder = osp.dirname(osp.abspath(path))
+    current = folder
+    while True:
+        if any(osp.isdir(osp.join(current, name)) for name in VCS_NAMES):
+            return current
+        parent = osp.dirname(current)
+        if parent == current:
+            break
+        current = parent
+    cfg_paths = find_cfg_paths(path)
+    return osp.dirname(cfg_paths[0]) if cfg_paths else folder
+
+
+def is_below(path, folder):
+    """
+        Check if `path` is `folder` or below it.
+    """
+    return path == folder or path.startswith(folder.rstrip(os.sep) + os.sep)
+
+
+class RootManifest(object):
+    """
+        The database of the outputs generated by the templates below one root.
+        It is only opened once it is needed.
+    """
+
+    def __init__(self, path, root=None):
+        self.path = path
+        # read from the database if not given
+        self._root = root
+        self._connection = None
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            # imported here so that importing pydemx stays cheap
+            import sqlite3
+
+            os.makedirs(osp.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=60)
+            version = connection.execute("PRAGMA user_version").fetchone()[0]
+            if version != MANIFEST_FORMAT:
+                with connection:
+                    connection.execute("DROP TABLE IF EXISTS outputs")
+                    connection.execute("DROP TABLE IF EXISTS root")
+                    connection.execute(
+                        "PRAGMA user_version = {:d}".format(MANIFEST_FORMAT)
+                    )
+            connection.executescript(SCHEMA)
+            if self._root is not None:
+                with connection:
+                    connection.execute(
+                        "INSERT INTO root (path) SELECT ? "
+                        "WHERE NOT EXISTS (SELECT * FROM root)",
+                        (self._root,),
+                    )
+            self._connection = connection
+        return self._connection
+
+    @property
+    def root(self):
+        if self._root is None:
+            row = self.connection.execute("SELECT path FROM root").fetchone()
+            self._root = "" if row is None else row[0]
+        return self._root
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def update(self, generated, ignored=()):
+        """
+            Record the outputs `generated` in this run (see `describe_output`)
+            and mark all other outputs of their templates (and all outputs of
+            the `ignored` templates) as stale.
+        """
+        templates = {entry[1] for entry in generated} | set(ignored)
+        if not templates:
+            return
+        with self.connection as connection:
+            connection.executemany(
+                "UPDATE outputs SET stale = 1 WHERE template = ?",
+                ((template,) for template in templates),
+            )
+            connection.executemany(
+                "INSERT OR REPLACE INTO outputs ({}) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 0)".format(COLUMNS),
+                generated,
+            )
+
+    def iter_entries(self, path):
+        """
+            Yield all entries of outputs generated by templates that are (or
+            are below) `path` (absolute).
+        """
+        prefix = path.rstrip(os.sep) + os.sep
+        return self.connection.execute(
+            "SELECT {} FROM outputs WHERE template = ? "
+            "OR substr(template, 1, ?) = ? ORDER BY output".format(COLUMNS),
+            (path, len(prefix), prefix),
+        )
+
+    def forget(self, outputs):
+        with self.connection as connection:
+            connection.executemany(
+                "DELETE FROM outputs WHERE output = ?",
+                ((output,) for output in outputs),
+            )
+
+
+class Manifest(object):
+    """
+        Records which template generated which output file (see module
+        docstring), in one database per root so that unrelated trees do not
+        share one.
+    """
+
+    def __init__(self, folder=None):
+        if folder is None:
+            folder = osp.join(get_data_folder(), "manifests")
+        self.folder = folder
+        # by root
+        self._manifests = {}
+        # roots by folder of the templates
+        self._roots = {}
+
+    def get_root(self, template):
+        folder = osp.dirname(template)
+        root = self._roots.get(folder)
+        if root is None:
+            root = self._roots[folder] = find_root(template)
+        return root
+
+    def get(self, root):
+        """
+            Return the `RootManifest` of `root`.
+        """
+        manifest = self._manifests.get(root)
+        if manifest is None:
+            name = hashlib.sha1(root.encode("utf-8", "surrogateescape")).hexdigest()
+            manifest = self._manifests[root] = RootManifest(
+                osp.join(self.folder, name + MANIFEST_SUFFIX), root=root
+            )
+        return manifest
+
+    def find(self, path):
+        """
+            Return the `RootManifest`s of all roots containing `path` or below
+            it.
+        """
+        try:
+            names = sorted(os.listdir(self.folder))
+        except OSError:
+            return []
+        found = []
+        for name in names:
+            if not name.endswith(MANIFEST_SUFFIX):
+                continue
+            manifest = RootManifest(osp.join(self.folder, name))
+            root = manifest.root
+            manifest.close()
+            if root and (is_below(path, root) or is_below(root, path)):
+                found.append(self.get(root))
+        return found
+
+    def close(self):
+        for manifest in self._manifests.values():
+            manifest.close()
+        self._manifests.clear()
+
+    def update(self, generated, ignored=()):
+        """
+            Record the outputs `generated` in this run (see `describe_output`)
+            and mark all other outputs of their templates (and all outputs of
+            the `ignored` templates) as stale.
+        """
+        by_root = {}
+        for entry in generated:
+            by_root.setdefault(self.get_root(entry[1]), ([], []))[0].append(entry)
+        for template in ignored:
+            by_root.setdefault(self.get_root(template), ([], []))[1].append(template)
+        for root, (root_generated, root_ignored) in by_root.items():
+            self.get(root).update(root_generated, ignored=root_ignored)
+
+    def iter_entries(self, files_and_folders):
+        """
+            Yield `(manifest, entry)` for all entries of outputs generated by
+            templates that are (or are below) any of `files_and_folders`.
+        """
+        for path in files_and_folders:
+            path = osp.abspath(path)
+            for manifest in self.find(path):
+                for entry in manifest.iter_entries(path):
+                    yield manifest, entry
+
+    def get_state(self, entry):
+        """
+            Return the state of the output of `entry` (see `STATES`).
+        """
+        output, template, _, digest, size, mtime_ns, template_mtime_ns, stale = entry
+        try:
+            template_st = os.stat(template)
+        except OSError:
+            template_st = None
+        if stale or template_st is None:
+            return "stale"
+
+        try:
+            st = os.stat(output)
+        except OSError:
+            return "missing"
+        if (st.st_size, st.st_mtime_ns) != (size, mtime_ns) and (
+            st.st_size != size or m.hash_file(output).hex() != digest
+        ):
+            return "modified"
+
+        if template_st.st_mtime_ns != template_mtime_ns:
+            return "outdated"
+        return "ok"
+
+    def status(self, files_and_folders):
+        """
+            Return `(state, entry)` for the outputs of all templates in
+            `files_and_folders` (see `iter_entries`).
+        """
+        return [
+            (self.get_state(entry), entry)
+            for _, entry in self.iter_entries(files_and_folders)
+        ]
+
+    def clean(self, files_and_folders):
+        """
+            Remove all stale outputs of templates in `files_and_folders` (along
+            with their entries) unless they were modified since they were
+            generated. Returns the number of removed files.
+        """
+        removed = []
+        forget = {}
+        for manifest, entry in list(self.iter_entries(files_and_folders)):
+            if self.get_state(entry) != "stale":
+                continue
+            output, _, _, digest, size = entry[:5]
+            try:
+                st = os.stat(output)
+            except OSError:
+                # already gone
+                forget.setdefault(manifest, []).append(output)
+                continue
+            if st.st_size != size or m.hash_file(output).hex() != digest:
+                log.warn("Keeping modified stale output {}".format(output))
+                continue
+            try:
+                os.remove(output)
+            except OSError as e:
+                log.warn("Could not remove {}: {}".format(output, e))
+                continue
+            log.info("Removed {}".format(output))
+            removed.append(output)
+            forget.setdefault(manifest, []).append(output)
+
+        for manifest, outputs in forget.items():
+            manifest.forget(outputs)
+        return len(removed)
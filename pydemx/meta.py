@@ -27,10 +27,18 @@ from .logcfg import log
 
 
 class Singleton(type):
-    _instances = {}
+    """
+        Instances are registered by name, each class created with this
+        metaclass (including subclasses) has its own registry so that
+        registries of independent renders do not interfere.
+    """
+
+    def __init__(cls, name, bases, namespace):
+        super(Singleton, cls).__init__(name, bases, namespace)
+        cls._instances = {}
 
     def __call__(cls, name, *args, **kwargs):
-        log.debug("Getting replacement {}".format(name))
+        log.debug("Getting replacement %s", name)
         if name in cls.instances:
             instance = cls._instances[name]
             instance.__init__(name, *args, **kwargs)
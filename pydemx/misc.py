@@ -21,14 +21,48 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+import hashlib
+import itertools
+import locale
 import logging
 import os
 import os.path as osp
-from pprint import pformat as pf
+import stat
+import threading
+import types
 from contextlib import contextmanager
 
 from .logcfg import log
 
+# encoding used when writing files (same as the default of `open`)
+DEFAULT_ENCODING = locale.getpreferredencoding(False)
+
+
+def pf(obj):
+    """
+        Pretty-format `obj` (pprint is only imported when actually needed,
+        i.e. for debug output).
+    """
+    from pprint import pformat
+
+    return pformat(obj)
+
+
+class LazyPf(object):
+    """
+        Pretty-formats `obj` (see `pf`) only when converted to a string, so
+        that it can be passed as argument of log records that are usually not
+        emitted.
+    """
+
+    __slots__ = ["obj"]
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        return pf(self.obj)
+
 
 @contextmanager
 def save_filepos(fileobject):
@@ -47,22 +81,244 @@ def ensure_folder_exists(path):
         pass
 
 
+def hash_file(path, chunk_size=1024 * 1024):
+    """
+        Return the SHA-1 digest of the contents of the file at `path`.
+    """
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+_umask_lock = threading.Lock()
+
+
+def get_umask():
+    # the umask can only be read by setting it, so concurrent calls must not
+    # see the temporary value
+    with _umask_lock:
+        umask = os.umask(0)
+        os.umask(umask)
+    return umask
+
+
+def get_permissions(filename):
+    return stat.S_IMODE(os.stat(filename).st_mode)
+
+
+class AtomicUpdate(object):
+    """
+        Write-only (binary) file object that atomically replaces the contents
+        of `filename` when closed, but only if they actually change.
+
+        Written data is compared against the existing file on the fly; only
+        once a difference is found, a temporary file in the same folder is
+        created (holding the common prefix) to which all further data is
+        written. On `close` it is renamed to `filename`, so readers never see
+        a partially written file.
+
+        If `permissions` is None, the permissions of the existing file are
+        kept (or the default permissions used for new files).
+
+        `known_folders` can be a set of folders known to exist (shared between
+        updates), which are then not created again.
+
+        `umask` can be the umask of the process (if already known), otherwise
+        it is read when needed.
+    """
+
+    copy_chunk_size = 1024 * 1024
+
+    tmp_flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_CLOEXEC", 0)
+
+    # numbers temporary files created by this process
+    _tmp_counter = itertools.count()
+
+    def __init__(self, filename, permissions=None, known_folders=None, umask=None):
+        self.filename = filename
+        self.permissions = permissions
+        self.known_folders = known_folders
+        self.umask = umask
+        self.tmp_file = None
+        self.tmp_filename = None
+        # number of bytes identical to the existing file
+        self.matched = 0
+        # size of the new file
+        self.size = 0
+
+        # permissions of the existing file (None if there is none)
+        self.existing_permissions = None
+        try:
+            self.existing = open(filename, "rb")
+        except OSError:
+            self.existing = None
+        else:
+            self.existing_permissions = stat.S_IMODE(
+                os.fstat(self.existing.fileno()).st_mode
+            )
+            if self.known_folders is not None:
+                self.known_folders.add(osp.dirname(filename))
+
+        # the permissions the temporary file is created with might be reduced
+        # by the umask
+        self.umask_applies = True
+        if self.permissions is None:
+            if self.existing is not None:
+                self.permissions = self.existing_permissions
+            else:
+                self.permissions = 0o666 & ~self._get_umask()
+                self.umask_applies = False
+
+        if self.existing is None:
+            self._diverge()
+
+    def _get_umask(self):
+        if self.umask is None:
+            self.umask = get_umask()
+        return self.umask
+
+    def _ensure_folder(self, folder):
+        if self.known_folders is None:
+            ensure_folder_exists(folder)
+        elif folder not in self.known_folders:
+            ensure_folder_exists(folder)
+            self.known_folders.add(folder)
+
+    def _open_tmp_file(self, folder):
+        """
+            Create the temporary file with its final permissions.
+        """
+        prefix = osp.join(folder, "." + osp.basename(self.filename) + ".")
+        while True:
+            self.tmp_filename = "{}{}-{}.tmp".format(
+                prefix, os.getpid(), next(self._tmp_counter)
+            )
+            try:
+                fd = os.open(self.tmp_filename, self.tmp_flags, self.permissions)
+            except FileExistsError:
+                continue
+            break
+        if self.umask_applies and self.permissions & self._get_umask():
+            os.fchmod(fd, self.permissions)
+        return fd
+
+    def _diverge(self):
+        folder = osp.dirname(self.filename)
+        self._ensure_folder(folder)
+        try:
+            fd = self._open_tmp_file(folder)
+        except FileNotFoundError:
+            if self.known_folders is None:
+                raise
+            # the folder was removed since it was found
+            self.known_folders.discard(folder)
+            self._ensure_folder(folder)
+            fd = self._open_tmp_file(folder)
+        self.tmp_file = os.fdopen(fd, "wb")
+
+        if self.existing is not None:
+            self.existing.seek(0)
+            remaining = self.matched
+            while remaining > 0:
+                chunk = self.existing.read(min(remaining, self.copy_chunk_size))
+                self.tmp_file.write(chunk)
+                remaining -= len(chunk)
+            self.existing.close()
+            self.existing = None
+        self.size = self.matched
+
+    def write(self, data):
+        if self.tmp_file is None:
+            if self.existing.read(len(data)) == data:
+                self.matched += len(data)
+                return
+            self._diverge()
+        self.tmp_file.write(data)
+        self.size += len(data)
+
+    def close(self):
+        """
+            Returns True if the file was replaced, False if it was unchanged.
+        """
+        if self.tmp_file is None:
+            if len(self.existing.read(1)) == 0:
+                self.existing.close()
+                self.existing = None
+                return False
+            # the existing file is longer
+            self._diverge()
+
+        try:
+            self.tmp_file.close()
+            os.replace(self.tmp_filename, self.filename)
+        except BaseException:
+            self.abort()
+            raise
+        return True
+
+    def abort(self):
+        """
+            Discard all written data and leave the file untouched.
+        """
+        if self.existing is not None:
+            self.existing.close()
+            self.existing = None
+        if self.tmp_file is not None:
+            self.tmp_file.close()
+            try:
+                os.remove(self.tmp_filename)
+            except OSError:
+                pass
+
+
+def replace_file(filename, data, permissions=None, umask=None):
+    """
+        Atomically replace the contents of `filename` with `data` (bytes) if
+        they differ (see `AtomicUpdate`).
+
+        Returns True if the file was replaced.
+    """
+    update = AtomicUpdate(filename, permissions=permissions, umask=umask)
+    try:
+        update.write(data)
+    except BaseException:
+        update.abort()
+        raise
+    return update.close()
+
+
 def setifnone(dct, key, value):
     if dct.get(key, None) is None:
         dct[key] = value
 
 
-def execute_code(lines, local_context=None):
-    if local_context is None:
-        local_context = {}
+def compile_code(lines):
+    """
+        Compile the given lines of python code and return the code object.
+    """
     # if log.getEffectiveLevel() <= logging.DEBUG:
     # log.debug("Supplied lines:" + os.linesep + "{}".format(pf(lines)))
     combined_lines = os.linesep.join(lines) + os.linesep
     if log.getEffectiveLevel() <= logging.DEBUG:
-        log.debug("Compiling:" + os.linesep + combined_lines)
-        log.debug("Context: {}".format(pf(local_context)))
+        log.debug("Compiling:%s%s", os.linesep, combined_lines)
 
     compiled = compile(combined_lines, "<string>", "exec")
     if log.getEffectiveLevel() <= logging.DEBUG:
-        log.debug("Type: {}".format(type(compiled)))
-    exec(compiled, {}, local_context)
+        log.debug("Type: %s", type(compiled))
+    return compiled
+
+
+def execute_code(code, local_context=None):
+    """
+        Execute `code` (either a list of lines or an already compiled code
+        object) in `local_context`.
+    """
+    if local_context is None:
+        local_context = {}
+    if not isinstance(code, types.CodeType):
+        code = compile_code(code)
+    if log.getEffectiveLevel() <= logging.DEBUG:
+        log.debug("Context: %s", pf(local_context))
+    exec(code, {}, local_context)
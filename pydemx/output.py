@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2020 Oliver Breitwieser
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+    Output stage shared by all files converted in a run.
+"""
+
+import os
+import os.path as osp
+import threading
+
+from . import misc as m
+from .logcfg import log
+
+
+class OutputWriter(object):
+    """
+        Creates the `misc.AtomicUpdate`s for all output files of a run and
+        keeps track of the files written and of all generated outputs (see
+        `manifest.describe_output`).
+
+        Folders found to exist are remembered, so they are only created once
+        per run. If `fsync` is set, all written files (and their folders) are
+        flushed to disk at once by `finish` instead of after each file.
+
+        The umask is only read once (when creating the writer) as reading it
+        requires changing it.
+    """
+
+    def __init__(self, fsync=False):
+        self.fsync = fsync
+        self.known_folders = set()
+        self.umask = m.get_umask()
+        # (filename, size) of all files written since the last `drain`
+        self.written = []
+        # manifest entries of all outputs generated since the last `drain`
+        self.generated = []
+        self.lock = threading.Lock()
+
+    def update(self, filename, permissions=None):
+        """
+            Return an `AtomicUpdate` of `filename`, `add` has to be called if
+            it replaced the file.
+        """
+        return m.AtomicUpdate(
+            filename,
+            permissions=permissions,
+            known_folders=self.known_folders,
+            umask=self.umask,
+        )
+
+    def add(self, filename, size):
+        with self.lock:
+            self.written.append((filename, size))
+
+    def add_generated(self, entry):
+        with self.lock:
+            self.generated.append(entry)
+
+    def extend(self, written, generated=()):
+        """
+            Add files written and outputs generated elsewhere (e.g. by worker
+            processes, see `drain`).
+        """
+        with self.lock:
+            self.written.extend(written)
+            self.generated.extend(generated)
+
+    def drain(self):
+        """
+            Return and forget all files written and outputs generated so far
+            (as tuple).
+        """
+        with self.lock:
+            written, self.written = self.written, []
+            generated, self.generated = self.generated, []
+        return written, generated
+
+    def sync(self, filenames):
+        """
+            Flush the given files and the folders containing them to disk.
+        """
+        folders = set()
+        for filename in filenames:
+            folders.add(osp.dirname(filename))
+            self._sync_path(filename, os.O_RDONLY)
+        for folder in sorted(folders):
+            self._sync_path(folder, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+
+    def _sync_path(self, path, flags):
+        try:
+            fd = os.open(path, flags)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            log.warn("Could not sync {}: {}".format(path, e))
+
+    def finish(self):
+        """
+            Flush all files written so far to disk (if requested) and return
+            them along with all generated outputs (see `drain`).
+        """
+        written, generated = self.drain()
+        if self.fsync and written:
+            self.sync(filename for filename, _ in written)
+        return written, generated
@@ -24,20 +24,17 @@
 __all__ = ["Parser"]
 
 import re
-import io
 import copy
-import socket
-from pprint import pformat as pf
 import os
-import os.path as osp
 import logging
-import functools as ft
-import itertools as it
 
 from .logcfg import log
 from . import misc as m
+from .misc import LazyPf
+from .prelude import EMPTY, make_context
 from .replacements import make_replacement_t
-from . import io
+from .graph import ReplacementGraph
+from .keys import Groups
 
 
 class Parser(object):
@@ -50,7 +47,18 @@ class Parser(object):
         "multi_key_seperator",
     ]
 
-    def __init__(self, cfg, tokenizer):
+    def __init__(self, cfg, tokenizer, scans=None, prelude=EMPTY, libraries=()):
+        """
+            `scans` can hold the replacements found in the text and
+            replacement blocks by a previous parse of the same file (see
+            `self.scans`), in which case the blocks are not scanned again.
+
+            All names in `prelude` (see `Config.get_prelude`) are available
+            in the code blocks.
+
+            The replacements of all `libraries` (see `library.load`) are
+            defined before those of the file, which may override them.
+        """
         text_blocks = tokenizer.text_blocks
         repl_blocks = tokenizer.repl_blocks
         code_blocks = tokenizer.code_blocks
@@ -61,34 +69,39 @@ class Parser(object):
 
         self._create_utils()
 
+        for replacements in libraries:
+            self.include_library(replacements)
+
         self.text_blocks = text_blocks
 
+        self._rescan = scans is None
+        if self._rescan:
+            scans = {"text": [], "repl": []}
+        self.scans = scans
+
         # scrape all textblocks for defined replacements
         # scrape the contents of all replacement blcoks as well
-        for tb in text_blocks:
-            self.read_replacements(tb.lines)
+        for i, tb in enumerate(text_blocks):
+            self._read_block_replacements("text", i, tb.iter_lines())
 
         # define replacements from replacement blocks
         known_repl_block_names = set()
-        for rb in repl_blocks:
-            self.read_replacements(rb.lines)
+        for i, rb in enumerate(repl_blocks):
+            self._read_block_replacements("repl", i, rb.lines)
             match = self.matcher_repl_block_title.match(rb.title).groupdict()
 
-            log.debug("Match object for replacement block: {}".format(pf(match)))
+            log.debug("Match object for replacement block: %s", LazyPf(match))
 
             # if we haven't seen a replacement block yet, it should be inserted
             # into regular text where first defined
             if match["name"] not in known_repl_block_names:
                 known_repl_block_names.add(match["name"])
                 text_repl = self.replacement_t.format.format(name=match["name"])
-                if log.getEffectiveLevel() <= logging.DEBUG:
-                    log.debug(
-                        "Text inserted for replacement block: {}".format(pf(text_repl))
-                    )
+                log.debug("Text inserted for replacement block: %s", LazyPf(text_repl))
                 if rb.index > 0:
-                    self.text_blocks[rb.index - 1].lines.append(text_repl)
+                    self.text_blocks[rb.index - 1].append_line(text_repl)
                 else:
-                    self.text_blocks[0].lines.insert(0, text_repl)
+                    self.text_blocks[0].insert_line(text_repl)
 
             repl = self.replacement_t(match["name"])
             combined_lines = os.linesep.join(rb.lines)
@@ -101,32 +114,92 @@ class Parser(object):
                 else:
                     keys = [match["key"]]
 
-                log.debug("Keys for {}: {}".format(match["name"], pf(keys)))
+                log.debug("Keys for %s: %s", match["name"], LazyPf(keys))
 
                 for k in keys:
                     repl[k] = combined_lines
             else:
                 repl.default = combined_lines
 
-            if log.getEffectiveLevel() <= logging.DEBUG:
-                log.debug(pf(repl))
+            log.debug("%s", LazyPf(repl))
 
         # execute the code from code blocks
         # include a dummy cfg dict to be compatible with the first cfg block
 
         # allow the code lines to pass data along
-        context = {"R": self.replacement_t, "cfg": copy.deepcopy(cfg)}
-        m.execute_code(code_blocks[0].lines, context)
+        context = make_context(prelude, R=self.replacement_t, cfg=copy.deepcopy(cfg))
+        m.execute_code(code_blocks[0].compile(), context)
         for cb in code_blocks[1:]:
-            m.execute_code(cb.lines, context)
+            m.execute_code(cb.compile(), context)
+
+        # all replacements are defined now
+        self.graph = ReplacementGraph(self.replacement_t)
+        self.groups = Groups.from_cfg(cfg["groups"])
+        self.graph.check_cycles(self.groups)
+
+    def get_keys(self):
+        """
+            Return all key values for which at least one replacement defines a
+            specific value (sorted).
+
+            Groups (see `keys.Groups`) are replaced by their members, since the
+            key function never returns a group.
+        """
+        keys = set()
+        todo = []
+        for repl in self.replacement_t.instances.values():
+            todo.extend(repl.keys())
+        seen = set()
+        while todo:
+            key = todo.pop()
+            if key in seen:
+                continue
+            seen.add(key)
+            if key in self.groups:
+                todo.extend(self.groups.groups[key])
+            else:
+                keys.add(key)
+        return sorted(keys, key=str)
 
     def read_replacements(self, lines):
+        """
+            Define all replacements found in `lines` and return them as list
+            of `(name, default)`-tuples (one per name).
+        """
+        # name -> default (the last default given for a name wins)
+        found = {}
+        # checked once instead of for every line and match
+        debug = log.isEnabledFor(logging.DEBUG)
+        finditer = self.replacement_t.matcher.finditer
         for line in lines:
-            log.debug("Reading replacements for line: {}".format(line))
-            for match in self.replacement_t.matcher.finditer(line):
-                gd = match.groupdict()
-                log.debug("Read replacment {}".format(gd))
-                self.replacement_t(**gd)
+            if debug:
+                log.debug("Reading replacements for line: %s", line)
+            for match in finditer(line):
+                name, default = match.group("name", "default")
+                if debug:
+                    log.debug("Read replacment %s", match.groupdict())
+                if default is not None or name not in found:
+                    found[name] = default
+        found = list(found.items())
+        self.define_replacements(found)
+        return found
+
+    def include_library(self, replacements):
+        """
+            Define all replacements of a library (see `library.parse`).
+        """
+        for name, (default, values) in replacements.items():
+            self.replacement_t(name, default).update(values)
+
+    def define_replacements(self, found):
+        for name, default in found:
+            self.replacement_t(name, default)
+
+    def _read_block_replacements(self, kind, index, lines):
+        if self._rescan:
+            self.scans[kind].append(self.read_replacements(lines))
+        else:
+            self.define_replacements(self.scans[kind][index])
 
     def _create_utils(self):
         """
@@ -141,7 +214,7 @@ class Parser(object):
             )
         )
 
-        log.debug("Replacement block title matcher: {}".format(repl_block_title_line))
+        log.debug("Replacement block title matcher: %s", repl_block_title_line)
 
         self.matcher_repl_block_title = re.compile(repl_block_title_line)
 
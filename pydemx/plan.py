@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2020 Oliver Breitwieser
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+class RenderPlan(object):
+    """
+        Text compiled into literal segments and references to replacements.
+
+        `parts` alternates between literal text and replacement names (it
+        always starts and ends with a literal, possibly empty), so rendering
+        only has to resolve every other element and join.
+    """
+
+    __slots__ = ["parts"]
+
+    def __init__(self, matcher, text):
+        parts = []
+        pos = 0
+        for match in matcher.finditer(text):
+            parts.append(text[pos : match.start()])
+            parts.append(match.group("name"))
+            pos = match.end()
+        parts.append(text[pos:])
+        self.parts = parts
+
+    @property
+    def names(self):
+        """
+            Names of all referenced replacements (in order of appearance).
+        """
+        return self.parts[1::2]
+
+    def render(self, resolve):
+        """
+            Return the text with each replacement substituted by
+            `resolve(name)`.
+        """
+        parts = self.parts
+        if len(parts) == 1:
+            return parts[0]
+
+        rendered = list(parts)
+        for i in range(1, len(rendered), 2):
+            rendered[i] = resolve(rendered[i])
+        return "".join(rendered)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2020 Oliver Breitwieser
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+    Preludes: python files with helper code shared by many templates.
+
+    A prelude is executed only once per process (and again only if it
+    changes). All names it defines are available in the code blocks of every
+    template using it.
+"""
+
+import os
+import threading
+import types
+
+from .logcfg import log
+
+PRELUDE_FILENAME = "prelude.pydemx.py"
+
+EMPTY = types.MappingProxyType({})
+
+# path -> (modification time, size, namespace)
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def clear_cache():
+    """
+        Forget all loaded preludes.
+    """
+    with _cache_lock:
+        _cache.clear()
+
+
+def freeze(value, memo=None):
+    """
+        Return a read-only version of `value`: dicts become read-only mappings,
+        lists tuples and sets frozensets (recursively, also within tuples), all
+        other objects (including subclasses of these) are returned as they
+        are.
+
+        `memo` (id -> frozen value) keeps objects referenced several times
+        shared.
+    """
+    if memo is None:
+        memo = {}
+    frozen = memo.get(id(value))
+    if frozen is not None:
+        return frozen
+    if type(value) is dict:
+        frozen = types.MappingProxyType(
+            {k: freeze(v, memo) for k, v in value.items()}
+        )
+    elif type(value) in (list, tuple):
+        frozen = tuple(freeze(v, memo) for v in value)
+    elif type(value) is set:
+        frozen = frozenset(value)
+    else:
+        return value
+    memo[id(value)] = frozen
+    return frozen
+
+
+def execute(path):
+    """
+        Execute the prelude at `path` and return a read-only mapping of all
+        names it defines.
+
+        Containers bound to public names are frozen (see `freeze`), also for
+        the functions of the prelude, since they are shared by all templates.
+    """
+    log.debug("Executing prelude %s", path)
+    with open(path, "r") as f:
+        code = compile(f.read(), path, "exec")
+    namespace = {"__name__": "pydemx_prelude", "__file__": path}
+    exec(code, namespace)
+    memo = {}
+    for name, value in list(namespace.items()):
+        if not name.startswith("_"):
+            namespace[name] = freeze(value, memo)
+    return types.MappingProxyType(
+        {k: v for k, v in namespace.items() if not k.startswith("__")}
+    )
+
+
+def load(path):
+    """
+        Return the (cached) namespace of the prelude at `path`, EMPTY if `path`
+        is None.
+    """
+    if path is None:
+        return EMPTY
+
+    st = os.stat(path)
+    entry = _cache.get(path)
+    if entry is not None and entry[:2] == (st.st_mtime_ns, st.st_size):
+        return entry[2]
+
+    # only execute once even if several threads need the prelude at once
+    with _cache_lock:
+        entry = _cache.get(path)
+        if entry is not None and entry[:2] == (st.st_mtime_ns, st.st_size):
+            return entry[2]
+        namespace = execute(path)
+        _cache[path] = (st.st_mtime_ns, st.st_size, namespace)
+    return namespace
+
+
+def make_context(namespace, **context):
+    """
+        Return a context for executing code blocks that contains all names of
+        the prelude `namespace` (and the namespace itself as `prelude`) along
+        with `context`.
+
+        Names can be rebound within the context without affecting the prelude,
+        the objects they refer to are shared (see `execute`).
+    """
+    result = dict(namespace)
+    result["prelude"] = namespace
+    result.update(context)
+    return result
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2020 Oliver Breitwieser
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+    Per-file profiling of the conversion (see the --profile option).
+
+    The modules only needed while profiling are imported on demand so that
+    importing pydemx stays cheap.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+
+PHASES = ["deps", "cache", "tokenize", "config", "parse", "render", "write"]
+
+
+class FileProfile(object):
+    """
+        Collects the time spent in each phase of converting a single file as
+        well as some statistics.
+
+        Phases can be nested, the time of the outer phase then excludes the
+        time spent in the inner one (e.g. "write" excludes "render").
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.counters = {"bytes_in": 0, "bytes_out": 0, "replacements": 0}
+        # stack of [name, start, time spent in nested phases]
+        self._running = []
+        self._start = time.perf_counter()
+
+        import tracemalloc
+
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+
+    @contextmanager
+    def phase(self, name):
+        entry = [name, time.perf_counter(), 0.0]
+        self._running.append(entry)
+        try:
+            yield
+        finally:
+            self._running.pop()
+            elapsed = time.perf_counter() - entry[1]
+            self.phases[name] += elapsed - entry[2]
+            if self._running:
+                self._running[-1][2] += elapsed
+
+    def add(self, counter, value):
+        self.counters[counter] += value
+
+    def get_record(self, outcome):
+        """
+            Return the collected data as dictionary (suitable for JSON).
+        """
+        record = {
+            "file": self.filename,
+            "outcome": outcome,
+            "total": time.perf_counter() - self._start,
+            "phases": self.phases,
+        }
+        record.update(self.counters)
+
+        import tracemalloc
+
+        if tracemalloc.is_tracing():
+            record["tracemalloc_peak"] = tracemalloc.get_traced_memory()[1]
+        return record
+
+
+class NoProfile(object):
+    """
+        Stand-in for `FileProfile` if profiling is disabled.
+    """
+
+    @contextmanager
+    def phase(self, name):
+        yield
+
+    def add(self, counter, value):
+        pass
+
+
+NO_PROFILE = NoProfile()
+
+
+def start():
+    """
+        Start tracing memory allocations (needed for the reported peaks).
+    """
+    import tracemalloc
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def stop():
+    """
+        Stop tracing memory allocations (e.g. when running as daemon).
+    """
+    import tracemalloc
+
+    tracemalloc.stop()
+
+
+class ProfileWriter(object):
+    """
+        Writes profile records as JSON lines.
+    """
+
+    def __init__(self, filename):
+        self.file = open(filename, "w")
+
+    def write(self, record):
+        import json
+
+        self.file.write(json.dumps(record, sort_keys=True) + os.linesep)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
@@ -21,12 +21,12 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
-from pprint import pformat as pf
 import logging
 import re
 
 from .logcfg import log
 from .meta import Singleton
+from .misc import pf
 
 
 class Replacement(dict, metaclass=Singleton):
@@ -38,7 +38,7 @@ class Replacement(dict, metaclass=Singleton):
     def __init__(self, name, default=None):
         self.name = name
         if default is not None:
-            log.debug("{}: Setting default to {}".format(name, default))
+            log.debug("%s: Setting default to %s", name, default)
             self.default = default
         elif not hasattr(self, "default"):
             self.default = ""
@@ -66,18 +66,18 @@ class Replacement(dict, metaclass=Singleton):
             pre=prefix, post=suffix, sep=seperator
         )
 
-        log.debug("Replacement line: {}".format(replacement_line))
+        log.debug("Replacement line: %s", replacement_line)
         cls.matcher = re.compile(replacement_line)
 
         format_encode = lambda x: x.replace("{", "{{").replace("}", "}}")
         cls.format = "{pre}{{name}}{post}".format(
             pre=format_encode(prefix), post=format_encode(suffix)
         )
-        log.debug("Format-replacement: {}".format(cls.format))
+        log.debug("Format-replacement: %s", cls.format)
 
 
 def make_replacement_t(**cfg):
     """
         Generate and return a new replacement type with own registry.
     """
-    return type("Replacement", (Replacement,), {"_instances": {}})
+    return type("Replacement", (Replacement,), {})
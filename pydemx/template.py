@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2020 Oliver Breitwieser
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+    In-process API to render templates without going through files.
+"""
+
+import os.path as osp
+
+from . import library
+from . import logcfg
+from . import misc as m
+from .config import Config
+from .generator import Generator
+from .keys import get_key_value
+from .parser import Parser
+from .tokenizer import Tokenizer
+
+
+class Template(object):
+    """
+        A tokenized and parsed `.pydemx` template that can be rendered for any
+        number of keys.
+
+        Use one of the `from_*` constructors. Rendering does not access the
+        filesystem, everything is kept in memory. A template can be rendered
+        from several threads at once.
+    """
+
+    def __init__(self, tokenizer, filename=None):
+        """
+            Create a template from a `Tokenizer` holding all text blocks in
+            memory.
+
+            If `filename` is given, the cfg files found above it are applied
+            (like when converting the file), otherwise only the default config
+            and the cfg block of the template.
+        """
+        self.filename = filename
+        if tokenizer.ignore_file:
+            raise ValueError(
+                "Template is marked with {}.".format(tokenizer.NO_PARSE_TOKEN)
+            )
+
+        self.cfg = Config(filename, tokenizer.code_blocks[0])
+        self.parser = Parser(
+            self.cfg,
+            tokenizer,
+            prelude=self.cfg.get_prelude(),
+            libraries=library.load_all(self.cfg.include_paths),
+        )
+        # shared by the generators of all renders
+        self._block_plans = {}
+
+    @classmethod
+    def from_string(cls, text, filename=None):
+        """
+            Create a template from its contents.
+        """
+        return cls(Tokenizer.from_text(text), filename=filename)
+
+    @classmethod
+    def from_bytes(cls, data, encoding=None, filename=None):
+        """
+            Create a template from its encoded contents (by default in the same
+            encoding that is used for files).
+        """
+        if encoding is None:
+            encoding = m.DEFAULT_ENCODING
+        return cls.from_string(data.decode(encoding), filename=filename)
+
+    @classmethod
+    def from_path(cls, path):
+        """
+            Create a template from the file at `path`.
+        """
+        with open(path, "r") as f:
+            return cls(Tokenizer(f), filename=osp.abspath(path))
+
+    @property
+    def keys(self):
+        """
+            All keys for which at least one replacement defines a specific value
+            (sorted).
+        """
+        return self.parser.get_keys()
+
+    def render(self, key=None):
+        """
+            Return the template rendered for `key` (by default the key returned
+            by the configured key function).
+        """
+        if key is None:
+            key = get_key_value(self.cfg["key_func"])
+        with logcfg.file_context(self.filename):
+            generator = Generator(
+                self.cfg, self.parser, key_value=key, block_plans=self._block_plans
+            )
+            return generator.render()
+
+    def render_many(self, keys):
+        """
+            Return a dictionary mapping each of `keys` to the template rendered
+            for it.
+        """
+        return {key: self.render(key) for key in keys}
@@ -21,18 +21,175 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
-import functools as ft
+
 import logging
+import os
 
 from .logcfg import log
-from . import io
+from . import misc as m
+
+
+def split_lines(text):
+    """
+        Split `text` into lines (without line endings).
+    """
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    return lines
+
+
+def map_file(filename):
+    """
+        Return the contents of `filename` as read-only memory map (bytes if the
+        file is empty).
+    """
+    # only needed for large files
+    import mmap
+
+    with open(filename, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class Buffer(object):
+    """
+        Contents of a tokenized file shared by all of its blocks, which only
+        refer to them by offsets.
+
+        The contents are either kept as text (with line endings translated to
+        "\\n") or, for large files, read from a memory map of `source` (encoded
+        with `encoding`) that is only created once it is needed. Pages of the
+        memory map are released once they were accessed (see `access`), so
+        that memory usage does not grow with the size of the file.
+    """
+
+    # size of the parts of a memory map scanned at once by `find` and kept
+    # in memory while accessing it (see `access`)
+    window_size = 16 * 1024 * 1024
+    # pages before a released part mapped when accessing it (see `release`)
+    release_margin = 256 * 1024
+
+    __slots__ = ["_data", "source", "encoding", "_released"]
+
+    def __init__(self, data=None, source=None, encoding=None):
+        self._data = data
+        self.source = source
+        self.encoding = encoding
+        # start of the part of the memory map not released by `access`
+        self._released = 0
+
+    @classmethod
+    def from_text(cls, text):
+        if "\r" in text:
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+        return cls(data=text)
+
+    @classmethod
+    def from_file(cls, source):
+        return cls(source=source, encoding=m.DEFAULT_ENCODING)
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = map_file(self.source)
+        return self._data
+
+    def is_mapped(self):
+        return self.encoding is not None
+
+    def release(self, start, end):
+        """
+            Drop the pages of the memory map between `start` and `end` from
+            memory (they are read from the file again when needed).
+        """
+        data = self.data
+        if not hasattr(data, "madvise"):
+            return
+        # only needed for memory mapped files
+        import mmap
+
+        # pages just before `start` may have been mapped along with it
+        start = max(0, start - self.release_margin)
+        start -= start % mmap.PAGESIZE
+        if end > start:
+            data.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+    def access(self, start, end):
+        """
+            Note that the memory map is accessed between `start` and `end`.
+
+            Since it is mostly accessed front to back, everything accessed
+            before is released once that is more than `window_size`.
+        """
+        if start < self._released:
+            # accessed from the front again
+            self._released = start
+        elif end - self._released > self.window_size:
+            self.release(self._released, start)
+            self._released = start
+
+    def find(self, sub, start):
+        """
+            Return the position of the first occurrence of `sub` at or after
+            `start` (-1 if there is none).
+        """
+        data = self.data
+        if not self.is_mapped():
+            return data.find(sub, start)
+
+        # search memory maps in windows so that they can be released
+        while True:
+            stop = min(start + self.window_size, len(data))
+            self.access(start, stop)
+            # occurrences starting within the window may extend beyond it
+            found = data.find(sub, start, stop + len(sub) - 1)
+            if found != -1 or stop == len(data):
+                return found
+            start = stop
+
+    def get_text(self, start, end):
+        if self.encoding is None:
+            return self.data[start:end]
+        self.access(start, end)
+        return self.data[start:end].decode(self.encoding).replace("\r\n", "\n")
+
+    def iter_chunks(self, start, end, chunk_size):
+        """
+            Yield the text between `start` and `end` in chunks of whole lines of
+            about `chunk_size` characters.
+        """
+        data = self.data
+        newline = "\n" if self.encoding is None else b"\n"
+        while start < end:
+            stop = start + chunk_size
+            if stop < end:
+                stop = data.find(newline, stop - 1, end) + 1
+            if stop <= 0 or stop > end:
+                stop = end
+            yield self.get_text(start, stop)
+            start = stop
 
 
 class Block(object):
-    __slots__ = ["lines"]
+    """
+        A block only holds its location (`span`) in the shared `buffer`, its
+        lines are created whenever they are needed.
+    """
+
+    __slots__ = ["buffer", "span"]
 
-    def __init__(self):
-        self.lines = []
+    def __init__(self, buffer, span):
+        self.buffer = buffer
+        self.span = span
+
+    def get_text(self):
+        return self.buffer.get_text(*self.span)
+
+    @property
+    def lines(self):
+        return split_lines(self.get_text())
 
 
 class SpecialBlock(Block):
@@ -40,49 +197,254 @@ class SpecialBlock(Block):
 
 
 class CodeBlock(SpecialBlock):
-    pass
+    __slots__ = ["prefix", "code"]
+
+    def __init__(self, buffer, span, prefix=""):
+        super(CodeBlock, self).__init__(buffer, span)
+        self.prefix = prefix
+        self.code = None
+
+    @property
+    def lines(self):
+        # clear the prefix
+        prefix = self.prefix
+        return [
+            line[len(prefix) :] if line.startswith(prefix) else line
+            for line in split_lines(self.get_text())
+        ]
+
+    def compile(self):
+        """
+            Compile the block (once) and return the code object.
+        """
+        if self.code is None:
+            self.code = m.compile_code(self.lines)
+        return self.code
 
 
 class TextBlock(Block):
-    pass
+    """
+        Text blocks of large files are not kept in memory but read from the
+        memory mapped file whenever needed (`is_lazy`). Lines added by the
+        parser are kept in `prepended` and `appended`.
+    """
+
+    __slots__ = ["prepended", "appended"]
+
+    # approximate number of characters per chunk returned by `iter_text`
+    chunk_size = 64 * 1024
+
+    def __init__(self, buffer, span):
+        super(TextBlock, self).__init__(buffer, span)
+        self.prepended = []
+        self.appended = []
+
+    def is_lazy(self):
+        return self.buffer.is_mapped()
+
+    def insert_line(self, line):
+        """
+            Insert a line at the beginning of the block.
+        """
+        self.prepended.insert(0, line)
+
+    def append_line(self, line):
+        self.appended.append(line)
+
+    def iter_lines(self):
+        yield from self.prepended
+        if self.is_lazy():
+            for chunk in self.buffer.iter_chunks(*self.span, self.chunk_size):
+                yield from split_lines(chunk)
+        else:
+            yield from split_lines(self.get_text())
+        yield from self.appended
+
+    def iter_text(self):
+        """
+            Yield the text of the block in chunks of whole lines (including line
+            endings), a single chunk unless the block `is_lazy`.
+
+            Since replacements never span several lines, each chunk can be
+            processed on its own.
+        """
+        if not self.is_lazy():
+            text = self.get_text()
+            body = [text[:-1] if text.endswith("\n") else text] if text else []
+            yield os.linesep.join(self.prepended + body + self.appended) + os.linesep
+            return
+
+        start, end = self.span
+        if not (self.prepended or self.appended or start < end):
+            # same as for blocks kept in memory
+            yield os.linesep
+            return
+
+        if self.prepended:
+            yield os.linesep.join(self.prepended) + os.linesep
+        for chunk in self.buffer.iter_chunks(start, end, self.chunk_size):
+            yield chunk if chunk.endswith("\n") else chunk + os.linesep
+        if self.appended:
+            yield os.linesep.join(self.appended) + os.linesep
 
 
 class ReplacementBlock(SpecialBlock):
     __slots__ = ["title", "index"]
 
-    def __init__(self, title, index):
-        super(ReplacementBlock, self).__init__()
+    def __init__(self, buffer, span, title, index):
+        super(ReplacementBlock, self).__init__(buffer, span)
         self.title = title
         self.index = index
 
 
 class Tokenizer(object):
     """
-        Tokenizes the input file into blocks. 
+        Tokenizes the input file into blocks.
+
+        The whole file is scanned for magic lines at once; blocks only record
+        their location in the (shared) contents of the file.
     """
 
     NO_PARSE_TOKEN = "#PYDEMXIGNORE"
 
-    def __init__(self, file):
+    # files larger than this (in bytes) are not read into memory but memory
+    # mapped (see `from_path`)
+    stream_threshold = 16 * 1024 * 1024
+
+    def __init__(self, file, source=None):
+        """
+            If `file` is opened in binary mode, `source` has to be its filename
+            and the file is memory mapped instead of read into memory.
+        """
+        if source is not None:
+            buffer = Buffer.from_file(source)
+        else:
+            file.seek(0)
+            buffer = Buffer.from_text(file.read())
+        self._tokenize(buffer)
+
+    @classmethod
+    def from_text(cls, text):
+        """
+            Tokenize `text` (the contents of a file).
+        """
+        self = cls.__new__(cls)
+        self._tokenize(Buffer.from_text(text))
+        return self
+
+    @classmethod
+    def from_path(cls, filename):
+        """
+            Tokenize the file at `filename`.
+
+            Files larger than `stream_threshold` are memory mapped, all others
+            are read into memory at once.
+        """
+        if os.path.getsize(filename) > cls.stream_threshold:
+            return cls(None, source=filename)
+        else:
+            with open(filename, "rb") as f:
+                return cls.from_text(f.read().decode(m.DEFAULT_ENCODING))
+
+    @classmethod
+    def from_state(cls, state, source=None):
+        """
+            Recreate a tokenizer from a state returned by `get_state` without
+            tokenizing the file again.
+
+            `source` has to be the filename of the tokenized file if it was
+            memory mapped.
+        """
+        self = cls.__new__(cls)
+        self.ignore_file = state["ignore_file"]
+        if self.ignore_file:
+            return self
+
+        self.magic_line = state["magic_line"]
+        self.code_prefix = state["code_prefix"]
+
+        if state["text"] is None:
+            buffer = Buffer.from_file(source)
+        else:
+            buffer = Buffer(data=state["text"])
+
+        self.text_blocks = [TextBlock(buffer, span) for span in state["text_blocks"]]
+
+        self.code_blocks = []
+        for span, code in state["code_blocks"]:
+            block = CodeBlock(buffer, span, prefix=self.code_prefix)
+            block.code = code
+            self.code_blocks.append(block)
+
+        self.repl_blocks = [
+            ReplacementBlock(buffer, span, title=title, index=index)
+            for title, index, span in state["repl_blocks"]
+        ]
+        return self
+
+    def get_state(self):
+        """
+            Return the block structure (including compiled code blocks) as a
+            dictionary that can be stored with `marshal`.
+
+            The text of files that are memory mapped is not included.
+        """
+        if self.ignore_file:
+            return {"ignore_file": True}
+
+        return {
+            "ignore_file": False,
+            "magic_line": self.magic_line,
+            "code_prefix": self.code_prefix,
+            "text": None if self.buffer.is_mapped() else self.buffer.data,
+            "text_blocks": [tb.span for tb in self.text_blocks],
+            "code_blocks": [(cb.span, cb.compile()) for cb in self.code_blocks],
+            "repl_blocks": [(rb.title, rb.index, rb.span) for rb in self.repl_blocks],
+        }
+
+    def _tokenize(self, buffer):
         log.debug("Tokenizing file.")
-        file.seek(0)
+        self.buffer = buffer
+        data = buffer.data
+        if buffer.is_mapped():
+            newline = b"\n"
+            encode = lambda text: text.encode(buffer.encoding)
+        else:
+            newline = "\n"
+            encode = lambda text: text
+
+        def read_line(pos):
+            """
+                Return the line starting at `pos` (without line ending) and the
+                position of the next line. The line is None at the end of file.
+            """
+            if pos >= len(data):
+                return None, pos
+            end = data.find(newline, pos)
+            if end == -1:
+                end = next_pos = len(data)
+            else:
+                next_pos = end + 1
+            line = buffer.get_text(pos, end)
+            if line.endswith("\r"):
+                line = line[:-1]
+            return line, next_pos
 
-        first_line = io.readline(file)
+        first_line, pos = read_line(0)
 
         # ignore file if token present
         # (for example in config files)
         if first_line == self.NO_PARSE_TOKEN:
             self.ignore_file = True
-            file.seek(0)
             log.info("Ignoring file.")
             return
 
         # ignore a possible shebang
-        elif not first_line.startswith("#!/"):
-            file.seek(0)
+        elif first_line is None or not first_line.startswith("#!/"):
+            pos = 0
         self.ignore_file = False
 
-        self._extract_magic_line(file)
+        pos = self._extract_magic_line(read_line, pos)
 
         self.repl_blocks = []
         self.code_blocks = []
@@ -90,72 +452,78 @@ class Tokenizer(object):
 
         # the first block per definition is the configuration block, which is a
         # CodeBlock
-        current_block = CodeBlock()
+        current_type = CodeBlock
+        current_title = None
+        current_start = pos
         # the current index tracks where in terms of textblocks
         # replacementblocks are defined
         current_index = 0
 
-        # we alread read two lines
-        # plus we count lines starting at 1
-        line_offset = 2 + 1
-        for ln, line in enumerate(iter(ft.partial(io.readline, file), None)):
-
-            if self.is_magic_line(line):
-                # we will for sure have a new block, so file the current one
-                if log.getEffectiveLevel() <= logging.DEBUG:
-                    log.debug(
-                        "{} finished at line number {}.".format(
-                            current_block.__class__.__name__, ln + line_offset
-                        )
-                    )
-                current_index = self.file_new_block(current_block, current_index)
-
-                # see what kind of transition we need to make
-                if self.is_extended_magic_line(line):
-                    # extended magic lines always indicate a new replacement
-                    # block
-                    current_block = ReplacementBlock(
-                        title=line[len(self.magic_line) :], index=current_index
+        magic = encode(self.magic_line)
+        # checked once instead of for every magic line
+        debug = log.isEnabledFor(logging.DEBUG)
+        while True:
+            # only occurrences at the beginning of a line are magic lines
+            found = buffer.find(magic, pos)
+            while found > 0 and data[found - 1 : found] != newline:
+                found = buffer.find(magic, found + 1)
+            if found == -1:
+                break
+
+            line, pos = read_line(found)
+
+            # we will for sure have a new block, so file the current one
+            if debug:
+                log.debug(
+                    "{} finished at line number {}.".format(
+                        current_type.__name__, data.count(newline, 0, found) + 1
                     )
-
-                elif isinstance(current_block, TextBlock):
-                    # if we are currently in a TextBlock a regular magic line
-                    # defines the start of a CodeBlock
-                    current_block = CodeBlock()
-
-                else:
-                    # if we are currently in a Code or ReplacementBlock, it will
-                    # be ended by a magic line
-                    current_block = TextBlock()
-
-            elif isinstance(current_block, CodeBlock) and line.startswith(
-                self.code_prefix
-            ):
-                # clear the prefix
-                current_block.lines.append(line[len(self.code_prefix) :])
+                )
+            current_index = self.file_new_block(
+                current_type, (current_start, found), current_title, current_index
+            )
+            current_start = pos
+
+            # see what kind of transition we need to make
+            if self.is_extended_magic_line(line):
+                # extended magic lines always indicate a new replacement block
+                current_type = ReplacementBlock
+                current_title = line[len(self.magic_line) :]
+
+            elif current_type is TextBlock:
+                # if we are currently in a TextBlock a regular magic line
+                # defines the start of a CodeBlock
+                current_type = CodeBlock
 
             else:
-                current_block.lines.append(line)
+                # if we are currently in a Code or ReplacementBlock, it will be
+                # ended by a magic line
+                current_type = TextBlock
 
         # finally, file the last block
-        self.file_new_block(current_block, current_index)
-
-    def file_new_block(self, block, current_text_index):
-        if block is None:
-            return current_text_index
+        self.file_new_block(
+            current_type, (current_start, len(data)), current_title, current_index
+        )
 
-        if isinstance(block, TextBlock):
-            self.text_blocks.append(block)
+    def file_new_block(self, block_type, span, title, current_text_index):
+        if block_type is TextBlock:
+            self.text_blocks.append(TextBlock(self.buffer, span))
 
             # we filed a new TextBlock instance, hence we need to increase the
             # counter
             current_text_index += 1
 
-        elif isinstance(block, CodeBlock):
-            self.code_blocks.append(block)
+        elif block_type is CodeBlock:
+            self.code_blocks.append(
+                CodeBlock(self.buffer, span, prefix=self.code_prefix)
+            )
 
-        elif isinstance(block, ReplacementBlock):
-            self.repl_blocks.append(block)
+        elif block_type is ReplacementBlock:
+            self.repl_blocks.append(
+                ReplacementBlock(
+                    self.buffer, span, title=title, index=current_text_index
+                )
+            )
 
         else:
             log.error("Invalid blocktype encountered, not saved!")
@@ -168,20 +536,29 @@ class Tokenizer(object):
     def is_extended_magic_line(self, line):
         return len(line) > len(self.magic_line)
 
-    def _extract_magic_line(self, file):
-        self.magic_line = io.readline(file)
+    def _extract_magic_line(self, read_line, pos):
+        """
+            Read the magic line and the prefix starting at `pos` and return the
+            position of the configuration block.
+        """
+        self.magic_line, pos = read_line(pos)
+        if not self.magic_line:
+            # every line would be a magic line
+            raise ValueError("The first line does not define a magic line.")
 
-        pos_second_line = file.tell()
         # the second line has to contain the magic line and the prefix
-        second_line = io.readline(file)
+        second_line, pos_third_line = read_line(pos)
 
-        if not self.is_magic_line(second_line) or len(second_line) == len(
-            self.magic_line
+        if (
+            second_line is None
+            or not self.is_magic_line(second_line)
+            or len(second_line) == len(self.magic_line)
         ):
             log.warn("Second line does not define prefix!")
             self.code_prefix = ""
             # since we saw no prefix the second line already is part of the
-            # configuration block -> rewind!
-            file.seek(pos_second_line)
+            # configuration block
+            return pos
         else:
             self.code_prefix = second_line[len(self.magic_line) :]
+            return pos_third_line
@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2020 Oliver Breitwieser
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+    Discovery of the files to convert.
+
+    Folders are scanned with `os.scandir` (so the file type information of the
+    directory entries is reused instead of stat-ing every entry) and whole
+    subtrees are pruned if they are version control or dependency folders
+    (see `PRUNE_NAMES`) or if they are matched by a `.pydemxignore` file.
+
+    `.pydemxignore` files use the syntax of `.gitignore` files: blank lines
+    and lines starting with `#` are skipped, `!` negates a pattern, a trailing
+    `/` only matches folders, patterns containing a `/` are relative to the
+    folder of the ignore file (all others match the name at any depth), `*`
+    and `?` do not match `/` and `**` matches any number of folders. Their
+    rules apply to everything below their folder.
+"""
+
+import os
+import os.path as osp
+import re
+
+from .logcfg import log
+
+IGNORE_FILENAME = ".pydemxignore"
+
+# folders that never contain files to convert
+PRUNE_NAMES = frozenset(
+    [
+        ".git",
+        ".hg",
+        ".svn",
+        ".bzr",
+        "_darcs",
+        "CVS",
+        "node_modules",
+        "__pycache__",
+        ".tox",
+        ".nox",
+        ".venv",
+        ".mypy_cache",
+        ".pytest_cache",
+    ]
+)
+
+
+def translate(pattern):
+    """
+        Translate a (gitignore-style) glob pattern into a regular expression
+        matching paths separated by `/`.
+    """
+    i = 0
+    n = len(pattern)
+    parts = []
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+            continue
+        elif pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+            continue
+        elif c == "*":
+            parts.append("[^/]*")
+        elif c == "?":
+            parts.append("[^/]")
+        elif c == "[":
+            j = pattern.find("]", i + 2)
+            if j < 0:
+                parts.append(re.escape(c))
+            else:
+                chars = pattern[i + 1 : j].replace("\\", "\\\\")
+                if chars[0] == "!":
+                    chars = "^" + chars[1:]
+                parts.append("[" + chars + "]")
+                i = j
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            parts.append(re.escape(pattern[i]))
+        else:
+            parts.append(re.escape(c))
+        i += 1
+    return "(?s:" + "".join(parts) + r")\Z"
+
+
+class IgnoreRule(object):
+    """
+        Single pattern of an ignore file located in `base`.
+    """
+
+    __slots__ = ["regex", "base", "negate", "dir_only", "anchored"]
+
+    def __init__(self, pattern, base):
+        self.base = base
+        self.negate = pattern.startswith("!")
+        if self.negate:
+            pattern = pattern[1:]
+        self.dir_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        self.anchored = "/" in pattern
+        self.regex = re.compile(translate(pattern.lstrip("/")))
+
+    def matches(self, path, is_dir):
+        if self.dir_only and not is_dir:
+            return False
+        if self.anchored:
+            # rules only ever apply to paths below their base
+            subpath = path[len(self.base) :].lstrip(os.sep)
+            if os.sep != "/":
+                subpath = subpath.replace(os.sep, "/")
+        else:
+            subpath = osp.basename(path)
+        return self.regex.match(subpath) is not None
+
+
+def read_ignore_file(path):
+    """
+        Return the rules defined in the ignore file at `path`.
+    """
+    base = osp.dirname(path)
+    rules = []
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                line = line.rstrip()
+                if len(line) == 0 or line.startswith("#"):
+                    continue
+                rules.append(IgnoreRule(line, base))
+    except (OSError, UnicodeDecodeError) as e:
+        log.warn("Cannot read {}: {}".format(path, e))
+    return tuple(rules)
+
+
+def is_ignored(rules, path, is_dir):
+    """
+        Check if `path` is ignored by `rules` (the last matching rule wins).
+    """
+    ignored = False
+    for rule in rules:
+        # only rules that would change the outcome need to be checked
+        if rule.negate != ignored:
+            continue
+        if rule.matches(path, is_dir):
+            ignored = not ignored
+    return ignored
+
+
+def _is_loop(path, folder):
+    """
+        Check if the symlinked folder `path` found in `folder` points to
+        `folder` or one of its parents.
+    """
+    target = osp.realpath(path)
+    current = osp.realpath(folder)
+    return current == target or current.startswith(target.rstrip(os.sep) + os.sep)
+
+
+class Walker(object):
+    """
+        Finds all files to convert in the given files and folders.
+
+        `is_template(path)` decides whether a file found in a folder should be
+        converted. If `ignore` is False, neither `PRUNE_NAMES` nor ignore files
+        are taken into account. Folders are scanned in `jobs` threads (which
+        mostly helps on network filesystems).
+
+        The ignore rules of all scanned folders are kept (see `clear_cache`).
+    """
+
+    def __init__(self, is_template, recursive=False, ignore=True, jobs=1):
+        self.is_template = is_template
+        self.recursive = recursive
+        self.ignore = ignore
+        self.jobs = jobs
+
+        # folder -> rules applying to its entries
+        self._rules = {}
+
+    def clear_cache(self):
+        """
+            Forget all ignore rules read so far (needed if they might have
+            changed).
+        """
+        self._rules.clear()
+
+    def scanned_folders(self):
+        """
+            Return all folders scanned so far.
+        """
+        return list(self._rules)
+
+    def is_ignored(self, path, is_dir=False):
+        """
+            Check if `path` is ignored, based on the rules of its (already
+            scanned) parent folder.
+        """
+        if not self.ignore:
+            return False
+        if is_dir and osp.basename(path) in PRUNE_NAMES:
+            return True
+        return is_ignored(self._rules.get(osp.dirname(path), ()), path, is_dir)
+
+    def find_files(self, files_and_folders):
+        """
+            Return all files to convert from the given files and folders.
+
+            Given files are always returned, the files found in given folders
+            are returned breadth first (and sorted by name within a folder).
+        """
+        files = []
+        level = []
+        for faf in files_and_folders:
+            if osp.isfile(faf):
+                files.append(faf)
+            elif osp.isdir(faf):
+                level.append(faf.rstrip(os.sep) or os.sep)
+
+        while level:
+            next_level = []
+            for found_files, found_folders in self._map(self._scan, level):
+                files.extend(found_files)
+                next_level.extend(found_folders)
+            level = next_level
+        return files
+
+    def _map(self, func, folders):
+        if self.jobs <= 1 or len(folders) <= 1:
+            return map(func, folders)
+
+        # only imported if needed to keep startup fast
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            return list(executor.map(func, folders))
+
+    def _scan(self, folder):
+        """
+            Return the files to convert and the folders to descend into found
+            in `folder`.
+        """
+        rules = self._rules.get(osp.dirname(folder), ())
+        try:
+            with os.scandir(folder) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as e:
+            log.warn("Cannot scan {}: {}".format(folder, e))
+            return [], []
+
+        if self.ignore and any(entry.name == IGNORE_FILENAME for entry in entries):
+            rules = rules + read_ignore_file(osp.join(folder, IGNORE_FILENAME))
+        self._rules[folder] = rules
+
+        files = []
+        folders = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+
+            if is_dir:
+                if not self.recursive:
+                    continue
+                if self.ignore and (
+                    entry.name in PRUNE_NAMES or is_ignored(rules, entry.path, True)
+                ):
+                    log.debug("Pruning %s", entry.path)
+                    continue
+                if entry.is_symlink() and _is_loop(entry.path, folder):
+                    log.debug("Not following %s (loop)", entry.path)
+                    continue
+                folders.append(entry.path)
+
+            elif self.is_template(entry.path) and entry.is_file():
+                if self.ignore and is_ignored(rules, entry.path, False):
+                    log.debug("Ignoring %s", entry.path)
+                    continue
+                files.append(entry.path)
+
+        return files, folders
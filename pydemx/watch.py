@@ -0,0 +1,393 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2020 Oliver Breitwieser
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import ctypes
+import ctypes.util
+import os
+import os.path as osp
+import select
+import struct
+import time
+
+from . import config
+from .config import CONFIG_FILENAME
+from .logcfg import log
+from .prelude import PRELUDE_FILENAME
+from .walk import IGNORE_FILENAME
+
+# inotify event masks (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify(object):
+    """
+        Minimal inotify binding (via ctypes) reporting changed paths in
+        watched folders.
+    """
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self.folders = {}
+        self.watched = set()
+
+    def watch(self, folder):
+        if folder in self.watched:
+            return
+        wd = self._add_watch(self.fd, os.fsencode(folder), WATCH_MASK)
+        if wd < 0:
+            log.warn(
+                "Cannot watch {}: {}".format(folder, os.strerror(ctypes.get_errno()))
+            )
+            return
+        self.folders[wd] = folder
+        self.watched.add(folder)
+
+    def wait(self, timeout=None):
+        """
+            Wait for changes and return the set of changed paths along with the
+            set of newly created folders.
+
+            Returns None for the changed paths if events were lost.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set(), set()
+
+        changed = set()
+        created_folders = set()
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                return None, created_folders
+            if mask & IN_IGNORED:
+                self.watched.discard(self.folders.pop(wd, None))
+                continue
+            if wd not in self.folders or not name:
+                continue
+
+            path = osp.join(self.folders[wd], name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    created_folders.add(path)
+            else:
+                changed.add(path)
+
+        return changed, created_folders
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Poller(object):
+    """
+        Fallback for systems without inotify: periodically compares the
+        modification times of all files in watched folders.
+    """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.watched = set()
+        self.snapshot = {}
+
+    def _scan(self, folder):
+        mtimes = {}
+        folders = set()
+        try:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir():
+                            folders.add(entry.path)
+                        else:
+                            mtimes[entry.path] = entry.stat().st_mtime_ns
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+        return mtimes, folders
+
+    def watch(self, folder):
+        if folder in self.watched:
+            return
+        self.watched.add(folder)
+        self.snapshot[folder] = self._scan(folder)
+
+    def wait(self, timeout=None):
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+
+        changed = set()
+        created_folders = set()
+        for folder in list(self.watched):
+            old_mtimes, old_folders = self.snapshot[folder]
+            mtimes, folders = self._scan(folder)
+            self.snapshot[folder] = mtimes, folders
+
+            for path in set(old_mtimes) | set(mtimes):
+                if old_mtimes.get(path) != mtimes.get(path):
+                    changed.add(path)
+            created_folders.update(folders - old_folders)
+
+        return changed, created_folders
+
+    def close(self):
+        pass
+
+
+def make_backend():
+    try:
+        return Inotify()
+    except (OSError, AttributeError, TypeError) as e:
+        log.info("inotify unavailable ({}), polling for changes.".format(e))
+        return Poller()
+
+
+class Watcher(object):
+    """
+        Watches the given files and folders (along with all folders that might
+        contain cfg files for them) and re-converts affected files on change.
+
+        A changed cfg file or prelude affects all files below its folder, a
+        changed ignore file causes all given folders to be searched again.
+        Files including a changed library (or prelude) are found via the
+        dependencies recorded when they were converted.
+    """
+
+    # wait this long for further events before converting
+    settle_time = 0.1
+
+    def __init__(self, files_and_folders, walker, convert, deps=None):
+        """
+            `walker` (a `walk.Walker`) finds the files to convert within the
+            given files and folders and `convert(filenames)` converts them.
+
+            `deps` is the `deps.DependencyStore` in which the conversions are
+            recorded.
+        """
+        self.files_and_folders = list(files_and_folders)
+        self.walker = walker
+        self.convert = convert
+        self.deps = deps
+        # included path -> names of the files including it
+        self.included = {}
+
+        # folders (absolute path -> name as given) in which new files are
+        # picked up
+        self.roots = {
+            osp.abspath(faf): faf for faf in files_and_folders if osp.isdir(faf)
+        }
+        # absolute path -> name used for conversion
+        self.files = {}
+
+        self.backend = make_backend()
+
+    def add_files(self, filenames):
+        for filename in filenames:
+            path = osp.abspath(filename)
+            self.files[path] = filename
+
+            folder = osp.dirname(path)
+            while True:
+                self.backend.watch(folder)
+                parent = osp.dirname(folder)
+                if parent == folder:
+                    break
+                folder = parent
+
+    def track_included(self, filenames):
+        """
+            Watch the files included by `filenames` (as recorded by their last
+            conversion).
+        """
+        if self.deps is None:
+            return
+        for filename in filenames:
+            for path in self.deps.get_included(filename):
+                self.included.setdefault(path, set()).add(filename)
+                self.backend.watch(osp.dirname(path))
+
+    def watch_scanned_folders(self):
+        for folder in self.walker.scanned_folders():
+            self.backend.watch(osp.abspath(folder))
+
+    def add_folder(self, path):
+        """
+            Pick up a folder created below a (recursively watched) root.
+        """
+        if not self.walker.recursive:
+            return []
+        for root, name in self.roots.items():
+            if path.startswith(root + os.sep):
+                folder = osp.join(name, osp.relpath(path, root))
+                if self.walker.is_ignored(folder, is_dir=True):
+                    return []
+                new_files = self.walker.find_files([folder])
+                self.watch_scanned_folders()
+                return new_files
+        return []
+
+    def rescan(self):
+        """
+            Search all given files and folders again (e.g. after the ignore
+            rules changed) and return the newly found files.
+        """
+        self.walker.clear_cache()
+        filenames = self.walker.find_files(self.files_and_folders)
+        new_files = [
+            filename
+            for filename in filenames
+            if osp.abspath(filename) not in self.files
+        ]
+        self.files = {}
+        self.add_files(filenames)
+        self.watch_scanned_folders()
+        return new_files
+
+    def get_name(self, path):
+        """
+            Return the name to convert a new file under, None if the file is
+            not watched.
+        """
+        if path in self.files:
+            return self.files[path]
+
+        if not self.walker.is_template(path):
+            return None
+
+        folder = osp.dirname(path)
+        for root, name in self.roots.items():
+            if folder == root or (
+                self.walker.recursive and folder.startswith(root + os.sep)
+            ):
+                name = osp.join(name, osp.relpath(path, root))
+                if self.walker.is_ignored(name):
+                    return None
+                return name
+        return None
+
+    def get_affected(self, changed):
+        """
+            Return all files that have to be re-converted due to changes of the
+            given paths.
+        """
+        affected = set()
+        for path in changed:
+            affected.update(self.included.get(path, ()))
+
+            if osp.basename(path) in (CONFIG_FILENAME, PRELUDE_FILENAME):
+                folder = osp.dirname(path)
+                affected.update(
+                    name
+                    for file_path, name in self.files.items()
+                    if file_path.startswith(folder + os.sep)
+                )
+                continue
+
+            name = self.get_name(path)
+            if name is None:
+                continue
+            if osp.isfile(path):
+                affected.add(name)
+                self.add_files([name])
+            else:
+                self.files.pop(path, None)
+
+        return sorted(affected)
+
+    def run(self):
+        self.add_files(self.walker.find_files(self.files_and_folders))
+        for root in self.roots:
+            self.backend.watch(root)
+        self.watch_scanned_folders()
+        self.track_included(self.files.values())
+
+        log.info("Watching {} files for changes.".format(len(self.files)))
+        try:
+            while True:
+                changed, created_folders = self.backend.wait()
+
+                # collect all events belonging to the same change
+                while changed or created_folders:
+                    more_changed, more_folders = self.backend.wait(self.settle_time)
+                    created_folders.update(more_folders)
+                    if more_changed is None:
+                        changed = None
+                    if changed is None or not (more_changed or more_folders):
+                        break
+                    changed.update(more_changed)
+
+                new_files = []
+                if changed is not None and any(
+                    osp.basename(path) == IGNORE_FILENAME for path in changed
+                ):
+                    log.info("Ignore rules changed, searching for files again.")
+                    new_files.extend(self.rescan())
+                else:
+                    for folder in created_folders:
+                        new_files.extend(self.add_folder(folder))
+                    self.add_files(new_files)
+
+                if changed is None or any(
+                    osp.basename(path) in (CONFIG_FILENAME, PRELUDE_FILENAME)
+                    for path in changed
+                ):
+                    config.clear_cache()
+
+                if changed is None:
+                    log.warn("Lost events, converting all files.")
+                    affected = sorted(self.files.values())
+                else:
+                    affected = sorted(set(self.get_affected(changed)) | set(new_files))
+
+                if affected:
+                    self.convert(affected)
+                    self.track_included(affected)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.backend.close()
@@ -46,7 +46,12 @@ setup(
     packages=["pydemx"],
     url="http://github.com/obreitwi/pydemx",
     license="MIT",
-    entry_points={"console_scripts": ["pydemx = pydemx.main:main_loop"]},
+    entry_points={
+        "console_scripts": [
+            "pydemx = pydemx.main:main_loop",
+            "pydemx-client = pydemx.client:main",
+        ]
+    },
     package_data={"pydemx": ["cfg.pydemx.default"],},
     zip_safe=True,
 )